@@ -0,0 +1,508 @@
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+import json
+import shutil
+import datetime
+import statistics
+import pandas as pd
+import ipac_table
+
+# Benchmarks for the spectra pipeline over the shipped downloaded_data/ corpus.
+# Run from anywhere: python benchmark.py reader|startup|memory|suite
+#
+# suite runs the ingest and query paths end to end in isolated workspaces
+# under benchmark_work/, so the real caches are never touched, optionally
+# against a synthetic corpus scaled up from the shipped one.
+#
+# suite timings depend on the machine, so no baseline is committed. Record
+# one on the machine that checks for regressions, from the commit to compare
+# against, and keep the file outside the repository and benchmark_work/, whose
+# workspaces are replaced by every run:
+#     python benchmark.py suite --scales 1 --save-baseline ~/exoatmos_baseline.json
+# then run the same scales and --rows on later commits with
+#     python benchmark.py suite --scales 1 --baseline ~/exoatmos_baseline.json
+# which exits non-zero when a REGRESSION_METRICS value is more than
+# --tolerance (default 25%) and, for timings, --min-delta-ms above the
+# baseline. Query and round-trip timings are the fastest of --repeats runs
+# per planet, with percentiles taken over planets. Scales missing from the
+# baseline are not compared, so record every scale that will be checked.
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+def legacy_load_data(path):
+    # The original per-line dict parser from load_data(), kept as the baseline
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    metadata = {}
+    data_lines = []
+    headers = None
+    reference = None
+
+    for line in content.split('\n'):
+        if line.startswith('\\'):
+            parts = line.strip()[1:].split('=', 1)
+            if len(parts) == 2:
+                key, value = parts
+                metadata[key.strip()] = value.strip().strip("'")
+                if key.strip() == 'REFERENCE':
+                    reference = value.strip().strip("'")
+        elif line.startswith('|'):
+            if headers is None:
+                headers = [h.strip() for h in line.split('|') if h.strip()]
+        elif line.strip() and not line.startswith('|'):
+            data_lines.append(line)
+
+    if not headers or not data_lines:
+        return None
+
+    data = []
+    for line in data_lines:
+        values = line.split()
+        if len(values) >= len(headers):
+            row = dict(zip(headers, values[:len(headers)]))
+            if reference:
+                row['REFERENCE'] = reference
+            elif 'REFERENCE' not in row:
+                row['REFERENCE'] = values[11] if len(values) > 11 else 'Unknown'
+            data.append(row)
+
+    if not data:
+        return None
+
+    df = pd.DataFrame(data)
+    for col in df.columns:
+        if col != 'REFERENCE':
+            df[col] = pd.to_numeric(df[col], errors='ignore')
+
+    return df, metadata
+
+def time_files(label, reader, files, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file in files:
+            reader(file)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{label:<10} {best:8.3f}s  {len(files) / best:10.1f} files/s")
+    return best
+
+def bench_reader(args):
+    files = sorted(glob.glob(os.path.join("downloaded_data", args.pattern)))
+    if not files:
+        print(f"No files match {args.pattern}", file=sys.stderr)
+        return
+
+    print(f"Parsing {len(files)} files, best of {args.repeat}")
+    legacy = time_files('legacy', legacy_load_data, files, args.repeat)
+    fast = time_files('ipac', ipac_table.read_ipac_table, files, args.repeat)
+    print(f"Speedup: {legacy / fast:.1f}x")
+
+# The JSON entry point used by server.js must never pull these in
+QUERY_PATH_FORBIDDEN = ('matplotlib',)
+
+STARTUP_SCRIPTS = {
+    'import': "import planet_data_viewer",
+    'query': ("import sys, planet_data_viewer as viewer; planet_data = {}; "
+              "viewer.get_planet_spectra(viewer.load_planets([sys.argv[1]], planet_data)[0], planet_data)"),
+}
+
+def parse_importtime(stderr):
+    # Lines look like "import time:  self [us] | cumulative | name", nested names are indented
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+# Appended to a startup script; prints the forbidden modules it left in sys.modules
+IMPORT_CHECK = """
+import sys
+print(','.join(sorted({name.split('.')[0] for name in sys.modules} & set(sys.argv[2].split(',')))))
+"""
+
+def check_query_imports(planet):
+    # The regression check: deterministic, whatever the machine's speed
+    failed = False
+    for scenario, script in STARTUP_SCRIPTS.items():
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', script + IMPORT_CHECK, planet, ','.join(QUERY_PATH_FORBIDDEN)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr, file=sys.stderr)
+            sys.exit(f"{scenario} startup failed with code {result.returncode}")
+        leaked = result.stdout.strip().splitlines()[-1] if result.stdout.strip() else ''
+        if leaked:
+            print(f"FAIL: {scenario} path imports {leaked}")
+            failed = True
+        else:
+            print(f"ok: {scenario} path imports none of {', '.join(QUERY_PATH_FORBIDDEN)}")
+    return failed
+
+def bench_startup(args):
+    failed = check_query_imports(args.planet)
+    for scenario, script in STARTUP_SCRIPTS.items():
+        command = [sys.executable, '-X', 'importtime', '-c', script, args.planet]
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = subprocess.run(command, capture_output=True, text=True)
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0:
+                print(result.stderr, file=sys.stderr)
+                sys.exit(f"{scenario} startup failed with code {result.returncode}")
+            best = elapsed if best is None else min(best, elapsed)
+
+        modules = parse_importtime(result.stderr)
+        heaviest = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+        print(f"{scenario}: {best * 1000:.0f} ms wall, {len(modules)} modules imported")
+        for name, (self_us, cumulative_us) in heaviest:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+        # Wall time depends on the machine, so the budget is only reported
+        if scenario == 'import' and best * 1000 > args.budget_ms:
+            print(f"    over budget: import takes {best * 1000:.0f} ms, budget is {args.budget_ms:.0f} ms")
+
+    if failed:
+        sys.exit(1)
+
+# Merges the full archive in a fresh interpreter and reports what it holds;
+# argv[1] is "compact" or "full"
+MEMORY_SCRIPT = """
+import sys, json, resource
+import planet_data_viewer as viewer
+planet_data = viewer.merge_planet_data(compact=sys.argv[1] == 'compact')
+frames = [data['merged_data'] for data in planet_data.values() if 'merged_data' in data]
+print(json.dumps({
+    'planets': len(planet_data),
+    'rows': sum(len(df) for df in frames),
+    'columns': sum(len(df.columns) for df in frames),
+    'frame_bytes': int(sum(df.memory_usage(deep=True).sum() for df in frames)),
+    'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+}))
+"""
+
+def bench_memory(args):
+    results = {}
+    for mode in ('full', 'compact'):
+        result = subprocess.run([sys.executable, '-W', 'ignore', '-c', MEMORY_SCRIPT, mode], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr, file=sys.stderr)
+            sys.exit(f"{mode} merge failed with code {result.returncode}")
+        results[mode] = json.loads(result.stdout.strip().splitlines()[-1])
+
+        stats = results[mode]
+        print(f"{mode:<8} {stats['planets']} planets, {stats['rows']} rows, {stats['columns'] / stats['planets']:.1f} columns/planet: "
+              f"frames {stats['frame_bytes'] / 2**20:7.1f} MiB, peak RSS {stats['peak_rss_kb'] / 1024:7.1f} MiB")
+
+    full, compact = results['full'], results['compact']
+    print(f"Compact store: {full['frame_bytes'] / compact['frame_bytes']:.1f}x smaller frames, "
+          f"{(full['peak_rss_kb'] - compact['peak_rss_kb']) / 1024:.1f} MiB less peak RSS")
+
+WORK_DIR = "benchmark_work"
+
+def write_synthetic_copy(source, target, copy_number, row_factor):
+    # The planet is renamed so copies are distinct planets (and distinct file
+    # contents, which the planet index would otherwise ignore as duplicates);
+    # data rows are repeated row_factor times
+    with open(source, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+
+    header = []
+    rows = []
+    for line in lines:
+        if line.startswith('\\') or line.startswith('|'):
+            if line.startswith('\\PL_NAME'):
+                line = f"{line.rstrip()} syn{copy_number}"
+            header.append(line)
+        elif line.strip():
+            rows.append(line)
+
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(header + rows * row_factor) + '\n')
+
+def prepare_workspace(scale, row_factor):
+    # benchmark_work/x{scale}r{rows}/ with every module of this folder linked in,
+    # a downloaded_data/ of scale copies of the corpus and a fresh
+    # last_update.json so the downloader never runs
+    workspace = os.path.join(WORK_DIR, f"x{scale}r{row_factor}")
+    data_dir = os.path.join(workspace, "downloaded_data")
+    sources = sorted(glob.glob(os.path.join("downloaded_data", "*.tbl")))
+
+    if not os.path.exists(os.path.join(workspace, 'corpus.json')):
+        shutil.rmtree(workspace, ignore_errors=True)
+        os.makedirs(data_dir)
+        print(f"Generating {len(sources) * scale} files in {workspace}", file=sys.stderr)
+        for source in sources:
+            filename = os.path.basename(source)
+            for copy_number in range(scale):
+                if copy_number == 0 and row_factor == 1:
+                    os.symlink(os.path.abspath(source), os.path.join(data_dir, filename))
+                else:
+                    stem, ext = os.path.splitext(filename)
+                    write_synthetic_copy(source, os.path.join(data_dir, f"{stem}_syn{copy_number}{ext}"), copy_number, row_factor)
+        with open(os.path.join(workspace, 'corpus.json'), 'w') as f:
+            json.dump({'scale': scale, 'rows': row_factor, 'files': len(sources) * scale}, f)
+
+    for module in glob.glob("*.py"):
+        link = os.path.join(workspace, module)
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(module), link)
+
+    with open(os.path.join(workspace, 'last_update.json'), 'w') as f:
+        json.dump({'last_update': datetime.datetime.now().isoformat()}, f)
+
+    return workspace
+
+def clear_workspace_caches(workspace):
+    shutil.rmtree(os.path.join(workspace, "parsed_cache"), ignore_errors=True)
+    for filename in ("planet_index.json", "planet_index.json.tmp"):
+        if os.path.exists(os.path.join(workspace, filename)):
+            os.remove(os.path.join(workspace, filename))
+
+# Runs inside a workspace: argv[1] is the number of planets queried, argv[2]
+# the profiler ('' for none), argv[3] where its output goes and argv[4] the
+# number of times each planet is queried, of which the fastest counts
+SUITE_SCRIPT = """
+import sys, time, json, resource, statistics
+stages = {}
+start = time.perf_counter()
+import planet_data_viewer as viewer
+import planet_index
+stages['import_s'] = time.perf_counter() - start
+
+def run():
+    start = time.perf_counter()
+    index = planet_index.update_planet_index("downloaded_data")
+    stages['index_cold_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planet_data = viewer.merge_planet_data()
+    stages['merge_cold_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    planet_data = viewer.merge_planet_data()
+    stages['merge_warm_s'] = time.perf_counter() - start
+
+    # The largest planets plus an even spread of the rest
+    by_size = sorted(planet_data, key=lambda name: -len(planet_data[name]['merged_data']))
+    count = min(int(sys.argv[1]), len(by_size))
+    sample = by_size[:count // 2] + by_size[count // 2::max(1, len(by_size) // max(1, count - count // 2))][:count - count // 2]
+    query_ms = []
+    serialise_ms = []
+    payload_bytes = 0
+    for name in sample:
+        best_query = best_serialise = None
+        for _ in range(int(sys.argv[4])):
+            start = time.perf_counter()
+            spectra = viewer.get_planet_spectra(name, planet_data)
+            elapsed = (time.perf_counter() - start) * 1000
+            best_query = elapsed if best_query is None else min(best_query, elapsed)
+            start = time.perf_counter()
+            payload = json.dumps(spectra, cls=viewer.NaNEncoder)
+            elapsed = (time.perf_counter() - start) * 1000
+            best_serialise = elapsed if best_serialise is None else min(best_serialise, elapsed)
+        query_ms.append(best_query)
+        serialise_ms.append(best_serialise)
+        payload_bytes += len(payload)
+
+    stages['planets'] = len(planet_data)
+    stages['files'] = len(index['files'])
+    stages['rows'] = sum(len(data['merged_data']) for data in planet_data.values())
+    stages['sample'] = sample
+    stages['query_ms'] = query_ms
+    stages['serialise_ms'] = serialise_ms
+    stages['payload_bytes'] = payload_bytes
+
+profiler, profile_path = sys.argv[2], sys.argv[3]
+if profiler == 'cprofile':
+    import cProfile
+    cProfile.run('run()', profile_path)
+elif profiler == 'pyinstrument':
+    from pyinstrument import Profiler
+    with Profiler() as pyinstrument_profiler:
+        run()
+    with open(profile_path, 'w') as f:
+        f.write(pyinstrument_profiler.output_html())
+else:
+    run()
+
+stages['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps(stages))
+"""
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def time_round_trips(workspace, planets, repeats):
+    # The /api/planet-spectra path minus express: a --serve worker, each
+    # planet requested once cold (merged on demand) and once warm. Repeated
+    # with a fresh worker, keeping each planet's fastest cold and warm time.
+    timings = {'cold': [None] * len(planets), 'warm': [None] * len(planets)}
+    for _ in range(repeats):
+        worker = subprocess.Popen([sys.executable, '-W', 'ignore', 'planet_data_viewer.py', '--serve'], cwd=workspace,
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        try:
+            for temperature in ('cold', 'warm'):
+                for i, name in enumerate(planets):
+                    start = time.perf_counter()
+                    worker.stdin.write(json.dumps({'id': i, 'planet': name, 'format': 'columnar'}) + '\n')
+                    worker.stdin.flush()
+                    response = json.loads(worker.stdout.readline())
+                    elapsed = (time.perf_counter() - start) * 1000
+                    if 'error' in response:
+                        sys.exit(f"Worker failed for {name}: {response['error']}")
+                    best = timings[temperature][i]
+                    timings[temperature][i] = elapsed if best is None else min(best, elapsed)
+        finally:
+            worker.stdin.close()
+            worker.wait()
+    return timings
+
+def run_suite_scale(scale, args):
+    workspace = prepare_workspace(scale, args.rows)
+    clear_workspace_caches(workspace)
+
+    profile_path = ''
+    if args.profile:
+        extension = 'prof' if args.profile == 'cprofile' else 'html'
+        profile_path = os.path.abspath(os.path.join(WORK_DIR, f"profile_x{scale}r{args.rows}.{extension}"))
+
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', SUITE_SCRIPT, str(args.queries), args.profile or '', profile_path,
+                             str(args.repeats)],
+                            cwd=workspace, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        sys.exit(f"Suite run for x{scale} failed with code {result.returncode}")
+    stages = json.loads(result.stdout.strip().splitlines()[-1])
+
+    round_trips = time_round_trips(workspace, stages['sample'], args.repeats)
+    if profile_path:
+        print(f"    profile written to {profile_path}")
+
+    return {
+        'queries': len(stages['sample']),
+        'repeats': args.repeats,
+        'files': stages['files'],
+        'planets': stages['planets'],
+        'rows': stages['rows'],
+        'import_s': stages['import_s'],
+        'index_cold_s': stages['index_cold_s'],
+        'merge_cold_s': stages['merge_cold_s'],
+        'merge_warm_s': stages['merge_warm_s'],
+        'merge_cold_files_per_s': stages['files'] / stages['merge_cold_s'],
+        'merge_warm_rows_per_s': stages['rows'] / stages['merge_warm_s'],
+        'query_p50_ms': statistics.median(stages['query_ms']),
+        'query_p95_ms': percentile(stages['query_ms'], 0.95),
+        'serialise_p50_ms': statistics.median(stages['serialise_ms']),
+        'serialise_p95_ms': percentile(stages['serialise_ms'], 0.95),
+        'payload_mib': stages['payload_bytes'] / 2**20,
+        'roundtrip_cold_p50_ms': statistics.median(round_trips['cold']),
+        'roundtrip_warm_p50_ms': statistics.median(round_trips['warm']),
+        'roundtrip_warm_p95_ms': percentile(round_trips['warm'], 0.95),
+        'peak_rss_mib': stages['peak_rss_kb'] / 1024
+    }
+
+# Metrics where a larger value is a regression; the rest are informational
+REGRESSION_METRICS = ('index_cold_s', 'merge_cold_s', 'merge_warm_s', 'query_p50_ms', 'query_p95_ms', 'serialise_p50_ms',
+                      'roundtrip_cold_p50_ms', 'roundtrip_warm_p50_ms', 'peak_rss_mib')
+
+def noise_floor(metric, min_delta_ms):
+    # Slowdown a timing metric may show without counting as a regression,
+    # in the metric's own unit
+    if metric.endswith('_ms'):
+        return min_delta_ms
+    if metric.endswith('_s'):
+        return min_delta_ms / 1000
+    return 0
+
+def compare_baseline(results, baseline, tolerance, min_delta_ms):
+    regressions = []
+    for scale, metrics in results.items():
+        # Percentiles over a different sample of planets are not comparable
+        for setting in ('queries', 'repeats'):
+            if scale in baseline and baseline[scale].get(setting) != metrics[setting]:
+                sys.exit(f"{scale} was run with {setting} {metrics[setting]}, the baseline with {baseline[scale].get(setting)}")
+        for metric in REGRESSION_METRICS:
+            reference = baseline.get(scale, {}).get(metric)
+            if (reference and metrics[metric] > reference * (1 + tolerance)
+                    and metrics[metric] - reference > noise_floor(metric, min_delta_ms)):
+                regressions.append(f"{scale} {metric}: {metrics[metric]:.3f} vs baseline {reference:.3f}")
+    return regressions
+
+def bench_suite(args):
+    if args.profile and (args.baseline or args.save_baseline):
+        sys.exit("Profiled timings are not comparable with a baseline; run --profile separately")
+
+    if args.profile == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            sys.exit("pyinstrument is not installed; use --profile cprofile or pip install pyinstrument")
+
+    results = {}
+    for scale in args.scales:
+        print(f"x{scale} (rows x{args.rows})")
+        metrics = run_suite_scale(scale, args)
+        results[f"x{scale}r{args.rows}"] = metrics
+        for metric, value in metrics.items():
+            print(f"    {metric:<24} {value:12.3f}" if isinstance(value, float) else f"    {metric:<24} {value:12d}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_baseline(results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the exoplanet spectra pipeline")
+    subparsers = parser.add_subparsers(dest='stage', required=True)
+
+    reader_parser = subparsers.add_parser('reader', help="legacy load_data() parser vs ipac_table reader")
+    reader_parser.add_argument('--pattern', default='*.tbl', help="glob inside downloaded_data/")
+    reader_parser.add_argument('--repeat', type=int, default=3)
+    reader_parser.set_defaults(func=bench_reader)
+
+    startup_parser = subparsers.add_parser('startup', help="interpreter startup and import cost of the JSON entry point")
+    startup_parser.add_argument('--planet', default='GJ 1214 b', help="planet looked up in the query scenario")
+    startup_parser.add_argument('--repeat', type=int, default=5)
+    startup_parser.add_argument('--top', type=int, default=8, help="number of heaviest imports to list")
+    startup_parser.add_argument('--budget-ms', type=float, default=400, help="report when the bare import is slower")
+    startup_parser.set_defaults(func=bench_startup)
+
+    memory_parser = subparsers.add_parser('memory', help="footprint of the merged archive, full vs compact store")
+    memory_parser.set_defaults(func=bench_memory)
+
+    suite_parser = subparsers.add_parser('suite', help="cold/warm ingest and query latency, throughput and peak RSS per corpus scale")
+    suite_parser.add_argument('--scales', type=lambda value: [int(scale) for scale in value.split(',')], default=[1],
+                              help="comma-separated corpus multipliers, e.g. 1,10,100")
+    suite_parser.add_argument('--rows', type=int, default=1, help="repeat every file's data rows this many times")
+    suite_parser.add_argument('--queries', type=int, default=20, help="planets queried per scale")
+    suite_parser.add_argument('--repeats', type=int, default=5, help="times each planet is queried, the fastest counts")
+    suite_parser.add_argument('--profile', choices=('cprofile', 'pyinstrument'), help="profile the ingest and query stages")
+    suite_parser.add_argument('--save-baseline', help="write the results to this JSON file")
+    suite_parser.add_argument('--baseline', help="fail if results regress against this JSON file")
+    suite_parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against --baseline")
+    suite_parser.add_argument('--min-delta-ms', type=float, default=5.0,
+                              help="a timing must also be this much slower than --baseline to count as a regression")
+    suite_parser.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
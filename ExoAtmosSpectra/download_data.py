@@ -9,52 +9,237 @@ sys.path.insert(0, user_site_packages)
 
 import datetime
 import json
+import time
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import planet_index
+import tbl_cache
+import instrumentation
+from instrumentation import stage
+
+log = instrumentation.get_logger('download')
 
 # Suppress the urllib3 warning more aggressively
 warnings.filterwarnings("ignore", category=Warning)
 import urllib3
 urllib3.disable_warnings()
 
-print(f"Download script using Python interpreter: {sys.executable}")
-print(f"Python version: {sys.version}")
-print(f"Python path: {sys.path}")
-print(f"User site-packages: {user_site_packages}")
+log.debug("Download script using Python interpreter: %s", sys.executable)
+log.debug("Python version: %s", sys.version)
+log.debug("Python path: %s", sys.path)
+log.debug("User site-packages: %s", user_site_packages)
 
 try:
     import requests
-    print("requests version:", requests.__version__)
+    log.debug("requests version: %s", requests.__version__)
 except ImportError:
-    print("The 'requests' module is not installed. You can install it using pip:")
-    print(f"{sys.executable} -m pip install requests")
-    print("After installing, please run this script again.")
+    log.error("The 'requests' module is not installed. Install it with: %s -m pip install requests", sys.executable)
     sys.exit(1)
 
-try:
-    import wget
-    print("wget version:", wget.__version__)
-except ImportError:
-    print("The 'wget' module is not installed. You can install it using pip:")
-    print(f"{sys.executable} -m pip install wget")
-    print("After installing, please run this script again.")
-    sys.exit(1)
+from requests.adapters import HTTPAdapter
 
-# Set the working directory to the ExoAtmosSpectra folder on the desktop
-desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-exoatmos_dir = os.path.join(desktop, "ExoAtmos")
-working_dir = os.path.join(exoatmos_dir, "ExoAtmosSpectra")
+# Set the working directory to the ExoAtmosSpectra folder this script lives in
+working_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(working_dir)
 
 # URL of the webpage
-DOWNLOAD_URL = 'https://exoplanetarchive.ipac.caltech.edu/work/TMP_fx7Vn3_18881/atmospheres/tab1/wget_atmospheres.bat'
+DOWNLOAD_URL = os.environ.get(
+    'EXOATMOS_DOWNLOAD_URL',
+    'https://exoplanetarchive.ipac.caltech.edu/work/TMP_fx7Vn3_18881/atmospheres/tab1/wget_atmospheres.bat'
+)
+
+# Days between refreshes; delta refreshes are cheap enough to run daily
+UPDATE_INTERVAL_DAYS = int(os.environ.get('EXOATMOS_UPDATE_INTERVAL_DAYS', '1'))
+
+DOWNLOAD_DIR = 'downloaded_data'
+DOWNLOAD_MANIFEST = 'download_manifest.json'
+DOWNLOAD_WORKERS = int(os.environ.get('EXOATMOS_DOWNLOAD_WORKERS', '8'))
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+CHUNK_SIZE = 64 * 1024
+MANIFEST_SAVE_INTERVAL = 25
+REQUEST_TIMEOUT = 60  # seconds
+LAST_UPDATE_FILE = 'last_update.json'
+
+# A listing that would retire more than this fraction of the downloaded files
+# is taken to be truncated, and nothing is retired
+MAX_RETIRED_FRACTION = float(os.environ.get('EXOATMOS_MAX_RETIRED_FRACTION', '0.2'))
+
+def parse_wget_script(path):
+    files = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('wget -O'):
+                parts = line.split()
+                files.append((parts[2], parts[3]))
+    return files
+
+def load_download_manifest():
+    if not os.path.exists(DOWNLOAD_MANIFEST):
+        return {}
+    try:
+        with open(DOWNLOAD_MANIFEST, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not read %s, starting a new one: %s", DOWNLOAD_MANIFEST, e)
+        return {}
+
+def load_pending_failures():
+    # Files whose download failed in the last refresh, retried by the next one
+    if not os.path.exists(LAST_UPDATE_FILE):
+        return []
+    with open(LAST_UPDATE_FILE, 'r') as f:
+        return json.load(f).get('pending_failures', [])
+
+def save_download_manifest(manifest):
+    tmp_file = DOWNLOAD_MANIFEST + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, DOWNLOAD_MANIFEST)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_download_current(entry, filename):
+    # The archive serves every listing from a fresh temporary workspace, so
+    # files are matched by name and verified by size and checksum, not by URL
+    path = os.path.join(DOWNLOAD_DIR, filename)
+    if not entry or not os.path.exists(path):
+        return False
+    return os.path.getsize(path) == entry['size'] and file_sha256(path) == entry['sha256']
+
+def listing_source(url):
+    # Listing URLs point into a per-request temporary workspace (TMP_...);
+    # drop it so an unchanged archive file keeps the same source across listings
+    return re.sub(r'/TMP_[^/]+/', '/', url)
+
+def plan_delta(files, manifest, retry=()):
+    # retry names files to fetch again even if the local copy looks current,
+    # such as changed files whose download failed in the last refresh
+    added = []
+    changed = []
+    for filename, url in files:
+        entry = manifest.get(filename)
+        if entry is None:
+            added.append((filename, url))
+        elif (filename in retry or listing_source(entry['url']) != listing_source(url)
+              or not is_download_current(entry, filename)):
+            changed.append((filename, url))
+
+    listed = {filename for filename, url in files}
+    retired = [filename for filename in manifest if filename not in listed]
+    return added, changed, retired
+
+def remove_retired_files(retired, manifest):
+    for filename in retired:
+        path = os.path.join(DOWNLOAD_DIR, filename)
+        if os.path.exists(path):
+            os.remove(path)
+        del manifest[filename]
+        instrumentation.count('files_retired')
+        log.info("Removed retired file %s", filename)
+
+def create_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def load_part_source(source_path):
+    try:
+        with open(source_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-def download_data():
+def remove_part(part_path):
+    for path in (part_path, part_path + '.source'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def fetch_to_part(session, url, part_path):
+    # Resume from an existing .part file when the server honours Range requests.
+    # Each .part file has a .part.source record of the listing source and the
+    # validator (ETag or Last-Modified) of the response it came from; a resume
+    # sends it as If-Range, so a file that changed since is sent whole, and a
+    # .part file without a matching record is discarded.
+    source_path = part_path + '.source'
+    validator = None
+    if os.path.exists(part_path):
+        source = load_part_source(source_path)
+        validator = source.get('validator')
+        if source.get('source') != listing_source(url) or not validator:
+            remove_part(part_path)
+            validator = None
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset else {}
+
+    with session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        if response.status_code == 416:
+            # Requested range is past the end; the partial file is unusable
+            remove_part(part_path)
+            raise IOError("Server rejected resume range, restarting download")
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            mode = 'ab'
+            expected_size = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+        else:
+            mode = 'wb'
+            content_length = response.headers.get('Content-Length')
+            expected_size = int(content_length) if content_length else None
+
+        # Weak ETags cannot be used in If-Range
+        etag = response.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+        with open(source_path, 'w') as f:
+            json.dump({'source': listing_source(url), 'validator': validator}, f)
+
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+    actual_size = os.path.getsize(part_path)
+    if expected_size is not None and actual_size != expected_size:
+        raise IOError(f"Incomplete download: got {actual_size} of {expected_size} bytes")
+
+def download_file(session, filename, url):
+    path = os.path.join(DOWNLOAD_DIR, filename)
+    part_path = path + '.part'
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            fetch_to_part(session, url, part_path)
+            break
+        except (requests.exceptions.RequestException, IOError) as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            permanent = status is not None and status < 500 and status not in (408, 429)
+            if permanent or attempt == MAX_RETRIES - 1:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+            instrumentation.count('download_retries')
+            log.warning("Retrying %s in %.0fs after error: %s", filename, delay, e)
+            time.sleep(delay)
+
+    os.replace(part_path, path)
+    os.remove(part_path + '.source')
+    return {'url': url, 'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+
+def download_data(full=False):
     # Send a GET request to the URL
-    print("Fetching webpage...")
+    log.info("Fetching webpage...")
     try:
-        response = requests.get(DOWNLOAD_URL)
+        with stage('listing'):
+            response = requests.get(DOWNLOAD_URL, timeout=REQUEST_TIMEOUT)
         response.raise_for_status()  # Raises an HTTPError for bad responses
     except requests.exceptions.RequestException as e:
-        print(f"Failed to retrieve the webpage. Error: {e}")
+        log.error("Failed to retrieve the webpage. Error: %s", e)
         return
 
     # Check if the request was successful
@@ -73,66 +258,115 @@ def download_data():
                 if not line.strip().startswith('#'):
                     file.write(line + '\n')
         
-        print(f"Content has been written to {output_file}")
+        log.debug("Content has been written to %s", output_file)
     else:
-        print(f"Failed to retrieve the webpage. Status code: {response.status_code}")
+        log.error("Failed to retrieve the webpage. Status code: %s", response.status_code)
         return
 
     # Create a directory to store the downloaded files
-    if not os.path.exists('downloaded_data'):
-        os.makedirs('downloaded_data')
-
-    # Read the content of the file
-    with open('paste.txt', 'r') as file:
-        content = file.read()
-
-    # Split the content into lines
-    lines = content.split('\n')
-
-    # Iterate through the lines
-    for line in lines:
-        if line.startswith('wget -O'):
-            # Split the line into parts
-            parts = line.split()
-            filename = parts[2]
-            url = parts[3]
-            
-            # Download the file
-            print(f"Downloading {filename}...")
+    if not os.path.exists(DOWNLOAD_DIR):
+        os.makedirs(DOWNLOAD_DIR)
+
+    # Only files that are new, changed or damaged are fetched, concurrently
+    # over one pooled session and resuming from .part files left by earlier runs.
+    # Files that dropped out of the listing are removed.
+    files = parse_wget_script('paste.txt')
+    manifest = load_download_manifest()
+    if full:
+        pending, retired = files, []
+        log.info("Full refresh: downloading %d files with %d workers...", len(pending), DOWNLOAD_WORKERS)
+    else:
+        with stage('plan'):
+            added, changed, retired = plan_delta(files, manifest, set(load_pending_failures()))
+        pending = added + changed
+        log.info("Delta refresh: %d added, %d changed, %d retired, %d up to date. Downloading with %d workers...",
+                 len(added), len(changed), len(retired), len(files) - len(pending), DOWNLOAD_WORKERS)
+
+    # An empty or truncated listing must not wipe the archive; its refresh is
+    # not recorded, so the next run tries again
+    listing_suspect = not files or len(retired) > MAX_RETIRED_FRACTION * len(manifest)
+    if listing_suspect:
+        log.error("The listing has %d files and would retire %d of %d downloaded files; not retiring any",
+                  len(files), len(retired), len(manifest))
+        retired = []
+
+    remove_retired_files(retired, manifest)
+
+    failed = []
+    session = create_session(DOWNLOAD_WORKERS)
+    with stage('download'), ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        futures = {executor.submit(download_file, session, filename, url): filename for filename, url in pending}
+        for completed, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
             try:
-                wget.download(url, out=os.path.join("downloaded_data", filename))
-                print(" Done.")
+                manifest[filename] = future.result()
+                instrumentation.count('files_downloaded')
+                instrumentation.count('bytes_downloaded', manifest[filename]['size'])
+                log.debug("Downloaded %s (%d/%d)", filename, completed, len(pending))
             except Exception as e:
-                print(f" Failed. Error: {str(e)}")
+                failed.append(filename)
+                instrumentation.count('download_failures')
+                log.warning("Failed to download %s. Error: %s", filename, e)
+
+            if completed % MANIFEST_SAVE_INTERVAL == 0:
+                save_download_manifest(manifest)
 
-    # After successful download, update the last_update.json file
+    save_download_manifest(manifest)
+
+    # Drop parse cache entries for everything that was replaced or removed;
+    # unchanged files keep theirs
+    cache_manifest = tbl_cache.load_manifest()
+    for filename in [name for name, url in pending] + retired:
+        tbl_cache.remove_entry(cache_manifest, filename)
+    tbl_cache.save_manifest(cache_manifest)
+
+    # Index the downloaded files by planet name so queries only open their own files
+    log.info("Updating planet index...")
+    with stage('index'):
+        index = planet_index.update_planet_index('downloaded_data')
+    log.info("Indexed %d files for %d planets.", len(index['files']), len(index['planets']))
+
+    # Rebuild the planet catalog and spectral index now rather than in the
+    # first request after the refresh
+    from planet_data_viewer import build_archive_indexes
+    build_archive_indexes(index)
+
+    # The refresh is recorded even when some downloads failed, so a file the
+    # archive keeps refusing does not trigger a refresh on every request; the
+    # failed files are retried by the next scheduled refresh
+    if failed:
+        log.warning("%d downloads failed. They are retried on the next refresh.", len(failed))
+    if listing_suspect:
+        return
     update_time = datetime.datetime.now().isoformat()
-    with open('last_update.json', 'w') as f:
-        json.dump({'last_update': update_time}, f)
+    with open(LAST_UPDATE_FILE, 'w') as f:
+        json.dump({'last_update': update_time, 'pending_failures': sorted(failed)}, f)
 
 def check_update_needed():
-    if not os.path.exists('last_update.json'):
-        print("No previous update record found. Update is needed.")
+    if not os.path.exists(LAST_UPDATE_FILE):
+        log.info("No previous update record found. Update is needed.")
         return True
     
-    with open('last_update.json', 'r') as f:
+    with open(LAST_UPDATE_FILE, 'r') as f:
         data = json.load(f)
     
     last_update = datetime.datetime.fromisoformat(data['last_update'])
     current_time = datetime.datetime.now()
     
     days_since_update = (current_time - last_update).days
-    print(f"Days since last update: {days_since_update}")
+    log.info("Days since last update: %d", days_since_update)
     
-    # Check if it's been more than a week since the last update
-    return days_since_update >= 7
+    return days_since_update >= UPDATE_INTERVAL_DAYS
 
 if __name__ == "__main__":
-    if check_update_needed():
-        print("Updating exoplanet data...")
-        download_data()
-        print("Update complete.")
+    full = '--full' in sys.argv
+    if full or check_update_needed():
+        log.info("Updating exoplanet data...")
+        download_data(full=full)
+        log.info("Update complete.")
     else:
-        print("Data is up to date. No update needed.")
+        log.info("Data is up to date. No update needed.")
     
-    print("\nIf you want to force an update, delete the 'last_update.json' file and run this script again.")
\ No newline at end of file
+    log.info("To force an update, delete the 'last_update.json' file and run this script again, "
+             "or run with --full to re-download every file instead of only the ones that changed.")
+    instrumentation.log_summary(log)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import logging
+from contextlib import contextmanager
+
+# Logging, stage timers and counters for the spectra pipeline.
+#
+# Every module logs through get_logger() to stderr, at EXOATMOS_LOG_LEVEL
+# (default INFO, where per-file and per-request detail is hidden) and as text
+# or, with EXOATMOS_LOG_FORMAT=json, one JSON object per line. Timers and
+# counters accumulate for the life of the process; summary() returns them as
+# a dict, which CLI runs log once at the end and the worker serves on request.
+LOG_LEVEL = os.environ.get('EXOATMOS_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('EXOATMOS_LOG_FORMAT', 'text')
+
+STARTED = time.time()
+stages = {}
+counters = {}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if hasattr(record, 'metrics'):
+            entry['message'] = 'metrics'
+            entry['metrics'] = record.metrics
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def configure_logging():
+    root = logging.getLogger('exoatmos')
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    root.propagate = False
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(f'exoatmos.{name}')
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        totals = stages.setdefault(name, {'count': 0, 'total_s': 0.0, 'max_s': 0.0})
+        totals['count'] += 1
+        totals['total_s'] += elapsed
+        totals['max_s'] = max(totals['max_s'], elapsed)
+
+def count(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+def summary():
+    return {
+        'uptime_s': round(time.time() - STARTED, 3),
+        'stages': {
+            name: {
+                'count': totals['count'],
+                'total_ms': round(totals['total_s'] * 1000, 3),
+                'mean_ms': round(totals['total_s'] * 1000 / totals['count'], 3),
+                'max_ms': round(totals['max_s'] * 1000, 3)
+            }
+            for name, totals in stages.items()
+        },
+        'counters': dict(counters)
+    }
+
+def log_summary(logger):
+    metrics = summary()
+    logger.info("metrics %s", json.dumps(metrics), extra={'metrics': metrics})
@@ -0,0 +1,106 @@
+import numpy as np
+
+# Reader for the IPAC ASCII tables (.tbl) served by the exoplanet archive.
+# The '|'-delimited header rows give every column a name, type, unit and null
+# value plus a fixed character span, so the data block is sliced column by
+# column as a 2D byte array and converted in bulk instead of row by row.
+
+FLOAT_TYPES = ('double', 'float', 'real', 'd', 'r', 'f')
+INT_TYPES = ('long', 'int', 'integer', 'l', 'i')
+
+def split_header_row(line, spans):
+    return [line[start:end].strip() for start, end in spans]
+
+def parse_header(header_rows):
+    # Column spans sit between consecutive '|' of the first header row
+    first = header_rows[0]
+    pipes = [i for i, c in enumerate(first) if c == '|']
+    spans = list(zip([p + 1 for p in pipes[:-1]], pipes[1:]))
+
+    rows = [split_header_row(row, spans) for row in header_rows]
+    names = rows[0]
+    types = rows[1] if len(rows) > 1 else ['char'] * len(names)
+    units = rows[2] if len(rows) > 2 else [''] * len(names)
+    nulls = rows[3] if len(rows) > 3 else ['null'] * len(names)
+
+    return [
+        {'name': name, 'type': col_type.lower(), 'unit': unit, 'null': null or 'null', 'span': span}
+        for name, col_type, unit, null, span in zip(names, types, units, nulls, spans)
+    ]
+
+def read_header(lines):
+    metadata = {}
+    header_rows = []
+    data_start = len(lines)
+
+    for i, line in enumerate(lines):
+        if line.startswith('\\'):
+            parts = line.strip()[1:].split('=', 1)
+            if len(parts) == 2:
+                key, value = parts
+                metadata[key.strip()] = value.strip().strip("'")
+        elif line.startswith('|'):
+            header_rows.append(line.rstrip('\r'))
+        elif line.strip():
+            data_start = i
+            break
+
+    return metadata, header_rows, data_start
+
+def convert_column(field, column):
+    null = column['null'].encode()
+
+    if column['type'] not in FLOAT_TYPES and column['type'] not in INT_TYPES:
+        # Text columns repeat a handful of values (authors, URLs), so only the
+        # distinct values are stripped and decoded
+        uniques, inverse = np.unique(field, return_inverse=True)
+        uniques = np.char.strip(uniques)
+        decoded = np.char.decode(uniques, 'ascii').astype(object)
+        decoded[(uniques == null) | (uniques == b'')] = np.nan
+        return decoded[inverse.ravel()]
+
+    values = np.char.strip(field)
+    is_null = (values == null) | (values == b'')
+
+    # Integer columns with nulls become float so the nulls can be NaN
+    if column['type'] in FLOAT_TYPES or is_null.any():
+        values[is_null] = b'nan'
+        return values.astype(np.float64)
+    return values.astype(np.int64)
+
+def read_ipac_table(path):
+    import pandas as pd
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        lines = f.read().split('\n')
+
+    metadata, header_rows, data_start = read_header(lines)
+    if not header_rows:
+        return None, metadata, []
+
+    schema = parse_header(header_rows)
+    data_lines = [line.rstrip('\r') for line in lines[data_start:] if line.strip()]
+    if not data_lines:
+        return None, metadata, schema
+
+    # One fixed-width byte row per data line, padded to the widest line.
+    # Spans count characters, so non-ASCII characters (e.g. accented author
+    # names) become one '?' byte each and the text columns of their rows are
+    # taken from the decoded lines afterwards.
+    width = max(max(len(line) for line in data_lines), schema[-1]['span'][1])
+    block = np.array([line.encode('ascii', 'replace') for line in data_lines], dtype=f'S{width}')
+    chars = block.view('S1').reshape(len(data_lines), width)
+    unicode_rows = [i for i, line in enumerate(data_lines) if not line.isascii()]
+
+    columns = {}
+    for column in schema:
+        start, end = column['span']
+        field = np.ascontiguousarray(chars[:, start:end]).view(f'S{end - start}').ravel()
+        values = convert_column(field, column)
+        if values.dtype == object:
+            for i in unicode_rows:
+                text = data_lines[i][start:end].strip()
+                values[i] = np.nan if text in ('', column['null']) else text
+        columns[column['name']] = values
+
+    return pd.DataFrame(columns), metadata, schema
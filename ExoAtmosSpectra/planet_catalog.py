@@ -0,0 +1,123 @@
+import os
+import json
+import bisect
+import difflib
+import planet_index
+import tbl_cache
+import instrumentation
+
+log = instrumentation.get_logger('planet_catalog')
+
+# One summary row per planet with spectra: aliases, spectrum types, point
+# counts, wavelength span and the instruments, facilities and references from
+# the .tbl metadata. It is rebuilt from a full merge after every data refresh
+# (build_archive_indexes() in planet_data_viewer.py), so listing or searching
+# planets never needs their spectra to be parsed.
+CATALOG_FILE = os.path.join(tbl_cache.CACHE_DIR, "planet_catalog.json")
+
+def metadata_values(metadata_list, key):
+    return sorted({metadata[key] for metadata in metadata_list if metadata.get(key) and metadata[key] != 'null'})
+
+def catalog_row(pl_name, data, aliases, value_columns):
+    df = data['merged_data']
+    wavelength_column = next((col for col in df.columns if 'WAVE' in col.upper()), None)
+
+    counts = {}
+    wave_min = None
+    wave_max = None
+    for spectrum_type, value_column in value_columns.items():
+        if wavelength_column is None or value_column not in df.columns:
+            continue
+        wavelengths = df.loc[df[value_column].notna(), wavelength_column].dropna()
+        if wavelengths.empty:
+            continue
+        counts[spectrum_type] = len(wavelengths)
+        wave_min = float(wavelengths.min()) if wave_min is None else min(wave_min, float(wavelengths.min()))
+        wave_max = float(wavelengths.max()) if wave_max is None else max(wave_max, float(wavelengths.max()))
+
+    return {
+        'name': pl_name,
+        'host': planet_index.host_star(pl_name),
+        'aliases': aliases,
+        'spectrum_types': list(counts),
+        'counts': counts,
+        'wave_min': wave_min,
+        'wave_max': wave_max,
+        'instruments': metadata_values(data['metadata'], 'INSTRUMENT'),
+        'facilities': metadata_values(data['metadata'], 'FACILITY'),
+        'references': metadata_values(data['metadata'], 'REFERENCE'),
+        'files': len(data['metadata'])
+    }
+
+def build_catalog(planet_data, index, value_columns):
+    # planet_data is a full merge_planet_data() result
+    aliases = {}
+    for alias, pl_name in index['aliases'].items():
+        aliases.setdefault(pl_name, []).append(alias)
+
+    rows = [
+        catalog_row(pl_name, planet_data[pl_name], sorted(aliases.get(pl_name, [])), value_columns)
+        for pl_name in sorted(planet_data)
+        if 'merged_data' in planet_data[pl_name]
+    ]
+    catalog = {'version': planet_index.archive_version(index), 'planets': rows}
+
+    os.makedirs(tbl_cache.CACHE_DIR, exist_ok=True)
+    tmp_file = CATALOG_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(catalog, f)
+    os.replace(tmp_file, CATALOG_FILE)
+    log.info("Built planet catalog with %d planets", len(rows))
+    return catalog
+
+def load_catalog(index):
+    # Returns None when the catalog is missing or older than the archive
+    if not os.path.exists(CATALOG_FILE):
+        return None
+
+    with open(CATALOG_FILE, 'r') as f:
+        catalog = json.load(f)
+    if catalog.get('version') != planet_index.archive_version(index):
+        return None
+
+    # Sorted (normalised name or alias, row number) keys for prefix search
+    keys = set()
+    for i, row in enumerate(catalog['planets']):
+        keys.add((planet_index.normalize_planet_name(row['name']), i))
+        keys.update((alias, i) for alias in row['aliases'])
+    catalog['search_keys'] = sorted(keys)
+    return catalog
+
+def search_catalog(catalog, query, limit=10):
+    # Rows ranked by exact name or alias match, then prefix, then substring,
+    # then, if nothing matched, fuzzy (difflib) similarity of the normalised names
+    normalized_query = planet_index.normalize_planet_name(query)
+    if not normalized_query:
+        return []
+
+    keys = catalog['search_keys']
+    ranked = {}
+
+    def add(i, rank):
+        if i not in ranked or rank < ranked[i]:
+            ranked[i] = rank
+
+    start = bisect.bisect_left(keys, (normalized_query, -1))
+    for key, i in keys[start:]:
+        if not key.startswith(normalized_query):
+            break
+        add(i, 0 if key == normalized_query else 1)
+
+    for key, i in keys:
+        if normalized_query in key:
+            add(i, 2)
+
+    if not ranked:
+        names = list(dict.fromkeys(key for key, i in keys))
+        close = difflib.get_close_matches(normalized_query, names, n=limit, cutoff=0.6)
+        for key, i in keys:
+            if key in close:
+                add(i, 3 + close.index(key))
+
+    best = sorted(ranked, key=lambda i: (ranked[i], catalog['planets'][i]['name']))[:limit]
+    return [catalog['planets'][i] for i in best]
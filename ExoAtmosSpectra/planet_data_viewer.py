@@ -2,19 +2,27 @@ import os
 import sys
 import site
 import glob
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
 import datetime
+import time
 import json
 import subprocess
-import math
 import traceback
-import re
-
-print(f"Python script started. Arguments: {sys.argv}", file=sys.stderr)
-print(f"Current working directory: {os.getcwd()}", file=sys.stderr)
-print(f"Contents of current directory: {os.listdir()}", file=sys.stderr)
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import tbl_cache
+import ipac_table
+import planet_index
+import planet_catalog
+import spectra_lod
+import spectral_index
+import spectra_aggregate
+import instrumentation
+from instrumentation import stage
+from planet_index import get_pl_name
+from spectra_encoding import NaNEncoder, RESPONSE_FORMATS, SPECTRUM_VALUE_COLUMNS, SPECTRUM_ERROR_COLUMNS, encode_spectra, iter_spectra_chunks
+
+log = instrumentation.get_logger('viewer')
+log.debug("Python script started. Arguments: %s", sys.argv)
 
 # Add user-specific site-packages to Python path
 user_site_packages = site.getusersitepackages()
@@ -23,77 +31,57 @@ sys.path.insert(0, user_site_packages)
 # Set the working directory to the ExoAtmosSpectra folder
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
-print(f"Working directory set to: {os.getcwd()}", file=sys.stderr)
-print(f"Contents of working directory: {os.listdir()}", file=sys.stderr)
-
-class NaNEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, float) and math.isnan(obj):
-            return 'NaN'
-        return super().default(obj)
-
-def get_pl_name(filename):
-    with open(filename, 'r') as f:
-        for line in f:
-            if line.startswith('\\PL_NAME'):
-                # Remove leading/trailing whitespace and quotes
-                pl_name = line.split('=')[1].strip().strip("'")
-                return pl_name
-    return None
+log.debug("Working directory set to: %s", os.getcwd())
+
+# Days between data refreshes, see download_data.py
+UPDATE_INTERVAL_DAYS = int(os.environ.get('EXOATMOS_UPDATE_INTERVAL_DAYS', '1'))
+
+# Minutes the worker waits before running the downloader again when a refresh
+# did not complete, e.g. because the archive listing could not be fetched
+UPDATE_RETRY_MINUTES = int(os.environ.get('EXOATMOS_UPDATE_RETRY_MINUTES', '60'))
+
+# Number of processes used to parse .tbl files in merge_planet_data()
+INGEST_WORKERS = int(os.environ.get('EXOATMOS_INGEST_WORKERS', '1'))
+
+# Columns kept in memory by merge_planet_data(compact=True): the wavelength,
+# the value of each spectrum type and the reference, which is all the API uses
+STORE_COLUMNS = ('CENTRALWAVELNG',) + tuple(SPECTRUM_VALUE_COLUMNS.values()) + ('REFERENCE',)
+
+# Also read when building the spectral index, for spectra_aggregate.py
+INDEX_EXTRA_COLUMNS = ('BANDWIDTH',) + tuple(col for columns in SPECTRUM_ERROR_COLUMNS.values() for col in columns)
+
+# Columns a full compact merge reads to rebuild the merged store, so warm
+# merges with or without INDEX_EXTRA_COLUMNS are both sliced from it
+MERGED_STORE_COLUMNS = STORE_COLUMNS + INDEX_EXTRA_COLUMNS
+
+# Points per message when spectra are streamed as NDJSON
+STREAM_CHUNK_SIZE = 1000
+
+# Wavelength bins of an aggregate_spectra() grid, by default and at most
+AGGREGATE_BINS = 50
+MAX_AGGREGATE_BINS = 10000
+
+# The planet catalog loaded by load_planet_catalog(), by archive version, so
+# the worker reads and sorts it once per version of the archive
+loaded_catalog = {}
 
 def load_data(filename):
     full_path = os.path.join("downloaded_data", filename)
     if not os.path.exists(full_path):
-        print(f"File does not exist: {full_path}")
+        log.warning("File does not exist: %s", full_path)
         return None
 
-    with open(full_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    metadata = {}
-    data_lines = []
-    headers = None
-    reference = None
-
-    for line in content.split('\n'):
-        if line.startswith('\\'):
-            parts = line.strip()[1:].split('=', 1)
-            if len(parts) == 2:
-                key, value = parts
-                metadata[key.strip()] = value.strip().strip("'")
-                if key.strip() == 'REFERENCE':
-                    reference = value.strip().strip("'")
-        elif line.startswith('|'):
-            if headers is None:
-                headers = [h.strip() for h in line.split('|') if h.strip()]
-        elif line.strip() and not line.startswith('|'):
-            data_lines.append(line)
-
-    if not headers or not data_lines:
-        print(f"No valid data found in the file {filename}")
-        return None
+    df, metadata, schema = ipac_table.read_ipac_table(full_path)
 
-    data = []
-    for line in data_lines:
-        values = line.split()
-        if len(values) >= len(headers):
-            row = dict(zip(headers, values[:len(headers)]))
-            if reference:
-                row['REFERENCE'] = reference
-            elif 'REFERENCE' not in row:
-                # If reference is not in metadata or the row, use the 12th column (index 11) as reference
-                row['REFERENCE'] = values[11] if len(values) > 11 else 'Unknown'
-            data.append(row)
-
-    if not data:
-        print(f"No valid data rows found in the file {filename}")
+    if df is None or df.empty:
+        log.debug("No valid data found in the file %s", filename)
         return None
 
-    df = pd.DataFrame(data)
-    
-    for col in df.columns:
-        if col != 'REFERENCE':
-            df[col] = pd.to_numeric(df[col], errors='ignore')
+    reference = metadata.get('REFERENCE')
+    if reference:
+        df['REFERENCE'] = reference
+    elif 'REFERENCE' not in df.columns:
+        df['REFERENCE'] = 'Unknown'
 
     return df, metadata
 
@@ -107,29 +95,73 @@ def determine_spectrum_type(df):
     else:
         return 'unknown'
 
-def merge_planet_data():
-    download_dir = "downloaded_data"
-    duplicate_files = detect_duplicate_files(download_dir)
-    if duplicate_files:
-        print("Warning: Duplicate files detected:", file=sys.stderr)
-        for file in duplicate_files:
-            print(f"  {file}", file=sys.stderr)
-        print("Please remove duplicate files manually before proceeding.", file=sys.stderr)
-        return {}
-
-    all_files = glob.glob(os.path.join(download_dir, "*.tbl"))
-    if not all_files:
-        print("No .tbl files found in the downloaded_data directory.", file=sys.stderr)
-        return {}
+def ingest_file(task):
+    # Read one .tbl file from the parse cache, or parse it and return the new
+    # cache entry. Runs in pool workers, so it only returns plain results and
+    # leaves the manifest to the caller. columns (None for all) limits the
+    # returned frame, the cache always holds every column.
+    file, entry, columns = task
+    if tbl_cache.is_entry_fresh(entry, file):
+        pl_name = entry['pl_name']
+        result = tbl_cache.read_entry(entry, columns) if pl_name else None
+        return pl_name, result, None
+
+    pl_name = get_pl_name(file)
+    result = None
+    if pl_name:
+        # A file that cannot be parsed is skipped like one without data, and
+        # its cache entry keeps it skipped until the file changes
+        try:
+            result = load_data(os.path.basename(file))
+        except (ValueError, UnicodeError, IndexError) as e:
+            log.warning("Skipping file %s that could not be parsed: %s", file, e)
+    new_entry = tbl_cache.write_entry(file, pl_name, result)
+    if result and columns is not None:
+        df, metadata = result
+        result = df[[col for col in df.columns if col in columns]], metadata
+    return pl_name, result, new_entry
+
+def merge_files(all_files, workers, columns, index):
+    # Parse (or read from the parse cache) and merge all_files per planet,
+    # under the planet index's spelling of each planet's name.
+    # Returns the planets' merged frames and metadata, and the planet of each
+    # file that had data.
+    import pandas as pd
 
     planet_data = {}
+    file_planets = {}
     total_files = len(all_files)
     processed_files = 0
+    cache_hits = 0
+
+    # Only files that are new or changed since the last run are parsed again
+    manifest = tbl_cache.load_manifest()
+    manifest_changed = False
+
+    if workers is None:
+        workers = INGEST_WORKERS
+
+    # Files are handed out in sorted order and results collected in that same
+    # order, so the merged frames do not depend on the number of workers
+    tasks = [(file, manifest['files'].get(os.path.basename(file)), columns) for file in all_files]
+    with stage('parse'):
+        if workers > 1 and len(tasks) > workers:
+            log.info("Ingesting %d files with %d workers", len(tasks), workers)
+            chunksize = max(1, len(tasks) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(ingest_file, tasks, chunksize=chunksize))
+        else:
+            results = [ingest_file(task) for task in tasks]
+
+    for file, (pl_name, result, new_entry) in zip(all_files, results):
+        if new_entry is None:
+            cache_hits += 1
+        else:
+            manifest['files'][os.path.basename(file)] = new_entry
+            manifest_changed = True
 
-    for file in all_files:
-        pl_name = get_pl_name(file)
         if pl_name:
-            result = load_data(os.path.basename(file))
+            pl_name = planet_index.resolve_planet_name(index, pl_name) or pl_name
             if result:
                 df, metadata = result
                 if not df.empty and not df.isnull().all().all():
@@ -137,147 +169,126 @@ def merge_planet_data():
                     if pl_name not in planet_data:
                         planet_data[pl_name] = {'data': [], 'metadata': []}
                     planet_data[pl_name]['data'].append(df)
-                    planet_data[pl_name]['metadata'].append(metadata)
+                    planet_data[pl_name]['metadata'].append({key: sys.intern(value) for key, value in metadata.items()})
+                    file_planets[os.path.basename(file)] = pl_name
                     processed_files += 1
-                    print(f"Processed file {file} for planet {pl_name}", file=sys.stderr)
+                    log.debug("Processed file %s for planet %s", file, pl_name)
                 else:
-                    print(f"Skipping file {file} as it contains no valid data.", file=sys.stderr)
+                    instrumentation.count('files_skipped')
+                    log.debug("Skipping file %s as it contains no valid data.", file)
             else:
-                print(f"No valid data found for {pl_name} in {file}", file=sys.stderr)
+                instrumentation.count('files_skipped')
+                log.debug("No valid data found for %s in %s", pl_name, file)
         else:
-            print(f"No planet name found in {file}", file=sys.stderr)
+            instrumentation.count('files_skipped')
+            log.debug("No planet name found in %s", file)
+
+    if manifest_changed:
+        tbl_cache.save_manifest(manifest)
 
-    print(f"Processed {processed_files} files out of {total_files}", file=sys.stderr)
+    instrumentation.count('files_parsed', total_files - cache_hits)
+    instrumentation.count('cache_hits', cache_hits)
+    log.debug("Processed %d files out of %d (%d from cache)", processed_files, total_files, cache_hits)
 
     # Merge data for each planet
-    for pl_name, data in planet_data.items():
-        if data['data']:
-            merged_df = pd.concat(data['data'], ignore_index=True)
+    with stage('merge'):
+        for pl_name, data in planet_data.items():
+            frames = data.pop('data')
+            merged_df = pd.concat(frames, ignore_index=True)
+            del frames
             wavelength_column = next((col for col in merged_df.columns if 'WAVE' in col.upper()), None)
             if wavelength_column:
-                merged_df = merged_df.sort_values(wavelength_column)
+                merged_df = merged_df.sort_values(wavelength_column, ignore_index=True)
             planet_data[pl_name]['merged_data'] = merged_df
-            print(f"Merged data for {pl_name}. Shape: {merged_df.shape}", file=sys.stderr)
+            log.debug("Merged data for %s. Shape: %s", pl_name, merged_df.shape)
+
+    return planet_data, file_planets
+
+def merge_planet_data(planet_names=None, workers=None, compact=True, extra_columns=()):
+    # With planet_names, only the files the planet index lists for those
+    # planets are read; otherwise the whole archive is merged. workers > 1
+    # parses files in a process pool (default: EXOATMOS_INGEST_WORKERS).
+    # compact keeps only STORE_COLUMNS and extra_columns, with REFERENCE as a categorical;
+    # compact=False keeps every column (e.g. the errors plotted by
+    # planet_plots.py). Either way each planet holds its merged frame and
+    # metadata only, not the per-file frames.
+    # Warm merges are sliced from the merged store (see tbl_cache.py), which
+    # every full merge that finds it stale rebuilds.
+    download_dir = "downloaded_data"
+    with stage('discover'):
+        all_files = glob.glob(os.path.join(download_dir, "*.tbl"))
+        if not all_files:
+            log.warning("No .tbl files found in the downloaded_data directory.")
+            return {}
+
+        # The planet index has already resolved duplicate copies of files
+        index = planet_index.update_planet_index(download_dir)
+        if planet_names is not None:
+            wanted_files = set()
+            for name in planet_names:
+                wanted_files.update(planet_index.files_for_planet(index, name))
+            all_files = [file for file in all_files if os.path.basename(file) in wanted_files]
         else:
-            print(f"No data to merge for {pl_name}", file=sys.stderr)
+            excluded = planet_index.excluded_files(index)
+            all_files = [file for file in all_files if os.path.basename(file) not in excluded]
+        all_files = sorted(all_files)
+
+    columns = STORE_COLUMNS + tuple(extra_columns) if compact else None
+
+    planet_data = None
+    store = tbl_cache.load_store()
+    if store is not None:
+        with stage('store'):
+            planet_data = tbl_cache.read_store(store, planet_index.archive_version(index), all_files, columns,
+                                               planet_names is None, ('REFERENCE',) if compact else ())
+        if planet_data is not None:
+            instrumentation.count('store_hits')
+            for data in planet_data.values():
+                data['metadata'] = [{key: sys.intern(value) for key, value in metadata.items()} for metadata in data['metadata']]
+
+    if planet_data is None and planet_names is None and compact:
+        # The store is rebuilt from this merge, read with MERGED_STORE_COLUMNS
+        read_columns = tuple(dict.fromkeys(MERGED_STORE_COLUMNS + tuple(extra_columns)))
+        planet_data, file_planets = merge_files(all_files, workers, read_columns, index)
+        with stage('store_build'):
+            tbl_cache.write_store(planet_data, file_planets, all_files, read_columns, planet_index.archive_version(index))
+        if set(columns) != set(read_columns):
+            for data in planet_data.values():
+                df = data['merged_data']
+                data['merged_data'] = df[[col for col in df.columns if col in columns]].copy()
+    elif planet_data is None:
+        planet_data, file_planets = merge_files(all_files, workers, columns, index)
+    else:
+        file_planets = None
+
+    # Cache entries of files that left the archive
+    if planet_names is None and file_planets is not None:
+        manifest = tbl_cache.load_manifest()
+        present_files = {os.path.basename(file) for file in all_files}
+        removed = [name for name in manifest['files'] if name not in present_files]
+        for filename in removed:
+            tbl_cache.remove_entry(manifest, filename)
+        if removed:
+            tbl_cache.save_manifest(manifest)
+
+    for pl_name, data in planet_data.items():
+        if compact and data['merged_data']['REFERENCE'].dtype != 'category':
+            data['merged_data']['REFERENCE'] = data['merged_data']['REFERENCE'].astype('category')
+        instrumentation.count('planets_merged')
+        instrumentation.count('rows_merged', len(data['merged_data']))
 
     return planet_data
 
-def search_planet(planet_data):
-    search_term = input("Enter a planet name to search for: ").lower()
-    
-    matching_planets = [pl_name for pl_name in planet_data.keys() if search_term in pl_name.lower()]
-    
-    if not matching_planets:
-        print("No matching planets found.")
-        return
-    
-    if len(matching_planets) > 1:
-        print(f"Found {len(matching_planets)} matching planets. Displaying data for the first match.")
-    
-    selected_planet = matching_planets[0]
-    df = planet_data[selected_planet]['merged_data']
-    metadata = planet_data[selected_planet]['metadata'][0]  # Using metadata from the first file
-    
-    print(f"\nData for {selected_planet}:")
-    print(f"Number of data points: {len(df)}")
-    print(df)
-    
-    wavelength_column = next((col for col in df.columns if 'WAVE' in col.upper()), None)
-    if wavelength_column:
-        print(f"\nWavelength range: {df[wavelength_column].min()} to {df[wavelength_column].max()}")
-    else:
-        print("\nNo wavelength column found in the data.")
-    
-    print("\nMetadata:")
-    for key, value in metadata.items():
-        print(f"{key}: {value}")
-    
-    # Plot the data
-    plt.figure(figsize=(12, 6))
-    if 'SPEC_PATH' in df.columns:
-        for source in df['SPEC_PATH'].unique():
-            source_data = df[df['SPEC_PATH'] == source]
-            if wavelength_column and 'PL_TRANDEP' in df.columns and 'PL_TRANDEPERR1' in df.columns and 'PL_TRANDEPERR2' in df.columns:
-                plt.errorbar(source_data[wavelength_column], source_data['PL_TRANDEP'], xerr=source_data['PL_TRANDEPERR1'], yerr=source_data['PL_TRANDEPERR2'], fmt='o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('Transit Depth (%)')
-                plt.title(f'Transmission Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            elif wavelength_column and 'PL_TRANDEP' in df.columns:
-                plt.plot(source_data[wavelength_column], source_data['PL_TRANDEP'], 'o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('Transit Depth (%)')
-                plt.title(f'Transmission Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            else:
-                print("Not enough data to plot transmission spectrum.")
-            
-            if wavelength_column and 'ESPECLIPDEP' in df.columns and 'ESPECLIPDEPERR1' in df.columns and 'ESPECLIPDEPERR2' in df.columns:
-                plt.errorbar(source_data[wavelength_column], source_data['ESPECLIPDEP'], xerr=source_data['ESPECLIPDEPERR1'], yerr=source_data['ESPECLIPDEPERR2'], fmt='o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('Eclipse Depth (%)')
-                plt.title(f'Eclipse Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            elif wavelength_column and 'ESPECLIPDEP' in df.columns:
-                plt.plot(source_data[wavelength_column], source_data['ESPECLIPDEP'], 'o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('Eclipse Depth (%)')
-                plt.title(f'Eclipse Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            else:
-                print("Not enough data to plot eclipse spectrum.")
-            
-            if wavelength_column and 'FLAM' in df.columns and 'FLAMERR1' in df.columns and 'FLAMERR2' in df.columns:
-                plt.errorbar(source_data[wavelength_column], source_data['FLAM'], xerr=source_data['FLAMERR1'], yerr=source_data['FLAMERR2'], fmt='o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('F_Lambda (W/(m^2 microns))')
-                plt.title(f'Direct Imaging Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            elif wavelength_column and 'FLAM' in df.columns:
-                plt.plot(source_data[wavelength_column], source_data['FLAM'], 'o', label=source)
-                plt.xlabel('Central Wavelength (microns)')
-                plt.ylabel('F_Lambda (W/(m^2 microns))')
-                plt.title(f'Direct Imaging Spectrum for {selected_planet}')
-                plt.legend()
-                plt.show()
-            else:
-                print("Not enough data to plot direct imaging spectrum.")
-    else:
-        if wavelength_column and 'PL_TRANDEP' in df.columns:
-            plt.plot(df[wavelength_column], df['PL_TRANDEP'], 'o')
-            plt.xlabel('Central Wavelength (microns)')
-            plt.ylabel('Transit Depth (%)')
-            plt.title(f'Transmission Spectrum for {selected_planet}')
-            plt.legend()
-            plt.show()
-        else:
-            print("Not enough data to plot transmission spectrum.")
-        
-        if wavelength_column and 'ESPECLIPDEP' in df.columns:
-            plt.plot(df[wavelength_column], df['ESPECLIPDEP'], 'o')
-            plt.xlabel('Central Wavelength (microns)')
-            plt.ylabel('Eclipse Depth (%)')
-            plt.title(f'Eclipse Spectrum for {selected_planet}')
-            plt.legend()
-            plt.show()
-        else:
-            print("Not enough data to plot eclipse spectrum.")
-        
-        if wavelength_column and 'FLAM' in df.columns:
-            plt.plot(df[wavelength_column], df['FLAM'], 'o')
-            plt.xlabel('Central Wavelength (microns)')
-            plt.ylabel('F_Lambda (W/(m^2 microns))')
-            plt.title(f'Direct Imaging Spectrum for {selected_planet}')
-            plt.legend()
-            plt.show()
-        else:
-            print("Not enough data to plot direct imaging spectrum.")
+def build_archive_indexes(index):
+    # Build the planet catalog and the spectral index from one full merge.
+    # download_data.py runs this after every refresh, so requests only build
+    # them when the files were changed by other means.
+    log.info("Building planet catalog and spectral index...")
+    planet_data = merge_planet_data(extra_columns=INDEX_EXTRA_COLUMNS)
+    with stage('catalog_build'):
+        planet_catalog.build_catalog(planet_data, index, SPECTRUM_VALUE_COLUMNS)
+    with stage('spectral_index_build'):
+        spectral_index.build_spectral_index(planet_data, SPECTRUM_VALUE_COLUMNS, SPECTRUM_ERROR_COLUMNS)
 
 def check_update_needed():
     if not os.path.exists('last_update.json'):
@@ -289,88 +300,553 @@ def check_update_needed():
     last_update = datetime.datetime.fromisoformat(data['last_update'])
     current_time = datetime.datetime.now()
     
-    # Check if it's been more than a week since the last update
-    return (current_time - last_update).days >= 7
+    # Same interval as download_data.py, which only fetches what changed
+    return (current_time - last_update).days >= UPDATE_INTERVAL_DAYS
 
-def run_downloader():
+def run_downloader(exit_on_failure=True):
+    # The worker passes exit_on_failure=False to keep serving the data already
+    # on disk when the downloader fails; it retries after UPDATE_RETRY_MINUTES
     python_executable = sys.executable
     result = subprocess.run([python_executable, 'download_data.py'], capture_output=True, text=True)
     if result.returncode != 0:
-        print("An error occurred while running the downloader script:")
-        print(result.stderr)
-        print("\nIt seems that some required modules are missing. Please install them using pip:")
-        print(f"{python_executable} -m pip install requests wget")
-        print("\nAfter installing the required modules, please run this script again.")
-        sys.exit(1)
-
-def detect_duplicate_files(directory):
-    file_pattern = re.compile(r'(.+?)(?:\s*\(\d+\))?\.(tbl)$')
-    file_groups = {}
-    duplicate_files = []
-
-    for filename in os.listdir(directory):
-        if filename.endswith('.tbl'):
-            match = file_pattern.match(filename)
-            if match:
-                base_name, extension = match.groups()
-                if base_name not in file_groups:
-                    file_groups[base_name] = [filename]
-                else:
-                    file_groups[base_name].append(filename)
-                    duplicate_files.extend(file_groups[base_name])
+        log.error("An error occurred while running the downloader script:\n%s", result.stderr)
+        log.error("If required modules are missing, install them with: %s -m pip install requests", python_executable)
+        if exit_on_failure:
+            sys.exit(1)
+        return False
+    return True
 
-    return duplicate_files
+def spectra_options_error(response_format, max_points, wavelength_range):
+    if response_format not in RESPONSE_FORMATS:
+        return {"error": f"Unknown response format {response_format}, expected one of {', '.join(RESPONSE_FORMATS)}"}
 
-def get_planet_spectra(planet_name, planet_data):
-    if planet_name not in planet_data:
-        print(f"Planet {planet_name} not found in the dataset. Available planets: {list(planet_data.keys())}", file=sys.stderr)
-        return {"error": f"Planet {planet_name} not found in the dataset"}
+    if max_points is not None and max_points < 2:
+        return {"error": "max_points must be at least 2"}
+
+    if wavelength_range is not None and wavelength_range[0] > wavelength_range[1]:
+        return {"error": "Wavelength range minimum is larger than its maximum"}
+
+    return None
 
+def select_spectra_frames(planet_name, planet_data, max_points=None, wavelength_range=None):
+    # Per spectrum type, the planet's (wavelength, value, REFERENCE) points
+    # after decimation and the wavelength window
     df = planet_data[planet_name]['merged_data']
-    spectra = {
-        'transmission': [],
-        'eclipse': [],
-        'direct_imaging': []
-    }
+    frames = {}
     
     wavelength_column = next((col for col in df.columns if 'WAVE' in col.upper()), None)
     
-    if wavelength_column:
-        if 'PL_TRANDEP' in df.columns:
-            spectra['transmission'] = df[[wavelength_column, 'PL_TRANDEP', 'REFERENCE']].dropna().to_dict('records')
-        
-        if 'ESPECLIPDEP' in df.columns:
-            spectra['eclipse'] = df[[wavelength_column, 'ESPECLIPDEP', 'REFERENCE']].dropna().to_dict('records')
-        
-        if 'FLAM' in df.columns:
-            spectra['direct_imaging'] = df[[wavelength_column, 'FLAM', 'REFERENCE']].dropna().to_dict('records')
+    for spectrum_type, value_column in SPECTRUM_VALUE_COLUMNS.items():
+        if wavelength_column and value_column in df.columns:
+            frames[spectrum_type] = df[[wavelength_column, value_column, 'REFERENCE']].dropna()
+
+    if max_points is not None:
+        # Levels of detail are built from the full series once per planet
+        if 'lod' not in planet_data[planet_name]:
+            planet_data[planet_name]['lod'] = spectra_lod.load_levels(planet_name, frames, wavelength_column, SPECTRUM_VALUE_COLUMNS)
+        levels = planet_data[planet_name]['lod']
+        frames = {
+            spectrum_type: spectra_lod.downsample(
+                frame, wavelength_column, SPECTRUM_VALUE_COLUMNS[spectrum_type], max_points,
+                {reference: series for (level_type, reference), series in levels.items() if level_type == spectrum_type},
+                wavelength_range)
+            for spectrum_type, frame in frames.items()
+        }
+    elif wavelength_range is not None:
+        # merged_data is sorted by wavelength, so the range is a binary search
+        frames = {
+            spectrum_type: frame.iloc[slice(*spectra_lod.window(frame[wavelength_column].to_numpy(), wavelength_range))]
+            for spectrum_type, frame in frames.items()
+        }
+
+    return frames, wavelength_column
+
+def get_planet_spectra(planet_name, planet_data, response_format='records', max_points=None, wavelength_range=None):
+    # max_points decimates every reference's series to at most that many
+    # points; wavelength_range = (min, max) keeps only points inside it
+    options_error = spectra_options_error(response_format, max_points, wavelength_range)
+    if options_error:
+        return options_error
+
+    if planet_name not in planet_data:
+        log.info("Planet %s not found in the dataset (%d planets loaded)", planet_name, len(planet_data))
+        return {"error": f"Planet {planet_name} not found in the dataset"}
+
+    with stage('query'):
+        frames, wavelength_column = select_spectra_frames(planet_name, planet_data, max_points, wavelength_range)
     
     # Check if any spectral data is available
-    if not any(spectra.values()):
+    if not any(len(frame) for frame in frames.values()):
         return {"message": f"No spectral data available for {planet_name}"}
     
-    return spectra
+    with stage('encode'):
+        return encode_spectra(frames, wavelength_column, response_format)
+
+def iter_planet_spectra(planet_name, planet_data, response_format='records', max_points=None, wavelength_range=None, chunk_size=STREAM_CHUNK_SIZE):
+    # Streaming form of get_planet_spectra(): yields chunks of at most
+    # chunk_size points (see iter_spectra_chunks()) and then one summary with
+    # the number of points per spectrum type, or just the error or message
+    options_error = spectra_options_error(response_format, max_points, wavelength_range)
+    if options_error is None and chunk_size < 1:
+        options_error = {"error": "chunk_size must be at least 1"}
+    if options_error:
+        yield options_error
+        return
+
+    if planet_name not in planet_data:
+        yield {"error": f"Planet {planet_name} not found in the dataset"}
+        return
+
+    with stage('query'):
+        frames, wavelength_column = select_spectra_frames(planet_name, planet_data, max_points, wavelength_range)
+    if not any(len(frame) for frame in frames.values()):
+        yield {"message": f"No spectral data available for {planet_name}"}
+        return
+
+    for chunk in iter_spectra_chunks(frames, wavelength_column, response_format, chunk_size):
+        yield chunk
+    yield {"done": True, "format": response_format, "counts": {spectrum_type: len(frame) for spectrum_type, frame in frames.items()}}
+
+def load_spectral_index():
+    # The archive-wide index is rebuilt from a full merge whenever any file changed
+    index = spectral_index.load_spectral_index()
+    if index is None:
+        build_archive_indexes(planet_index.update_planet_index("downloaded_data"))
+        index = spectral_index.load_spectral_index()
+    return index
+
+def query_wavelength_range(wavelength_range, spectrum_types=None, planet_names=None, response_format='records', summary=False):
+    # Spectra of every planet (or of planet_names) with points inside
+    # wavelength_range, keyed by planet. summary only returns the number of
+    # points and the wavelength span per planet and spectrum type.
+    import pandas as pd
+
+    if response_format not in RESPONSE_FORMATS:
+        return {"error": f"Unknown response format {response_format}, expected one of {', '.join(RESPONSE_FORMATS)}"}
+
+    if wavelength_range is None:
+        return {"error": "A wavelength range is required"}
+
+    if wavelength_range[0] > wavelength_range[1]:
+        return {"error": "Wavelength range minimum is larger than its maximum"}
+
+    unknown_types = [spectrum_type for spectrum_type in spectrum_types or [] if spectrum_type not in SPECTRUM_VALUE_COLUMNS]
+    if unknown_types:
+        return {"error": f"Unknown spectrum type {unknown_types[0]}, expected one of {', '.join(SPECTRUM_VALUE_COLUMNS)}"}
+
+    if planet_names is not None:
+        index = planet_index.update_planet_index("downloaded_data")
+        planet_names = [planet_index.resolve_planet_name(index, name) or name for name in planet_names]
+
+    index = load_spectral_index()
+    matches = spectral_index.query_range(index, wavelength_range, spectrum_types, planet_names)
+
+    planets = {}
+    for pl_name, points_by_type in matches.items():
+        if summary:
+            planets[pl_name] = {
+                spectrum_type: {
+                    'count': len(points),
+                    'wave_min': float(points['wavelength'][0]),
+                    'wave_max': float(points['wavelength'][-1]),
+                    'references': sorted({index['references'][code] for code in points['reference']})
+                }
+                for spectrum_type, points in points_by_type.items()
+            }
+            continue
+
+        frames = {}
+        for spectrum_type, points in points_by_type.items():
+            frames[spectrum_type] = pd.DataFrame({
+                'CENTRALWAVELNG': points['wavelength'],
+                SPECTRUM_VALUE_COLUMNS[spectrum_type]: points['value'],
+                'REFERENCE': [index['references'][code] for code in points['reference']]
+            })
+        planets[pl_name] = encode_spectra(frames, 'CENTRALWAVELNG', response_format)
+
+    return {'wave_min': wavelength_range[0], 'wave_max': wavelength_range[1], 'count': len(planets), 'planets': planets}
+
+def aggregate_spectra(spectrum_type, wavelength_range=None, bins=AGGREGATE_BINS, scale='log', planet_names=None,
+                      percentiles=spectra_aggregate.DEFAULT_PERCENTILES):
+    # Per-bin statistics of spectrum_type across every planet (or planet_names)
+    # on a common wavelength grid, see spectra_aggregate.py. A missing end of
+    # wavelength_range defaults to the span of the data.
+    if spectrum_type not in SPECTRUM_VALUE_COLUMNS:
+        return {"error": f"Unknown spectrum type {spectrum_type}, expected one of {', '.join(SPECTRUM_VALUE_COLUMNS)}"}
+
+    if scale not in spectra_aggregate.GRID_SCALES:
+        return {"error": f"Unknown grid scale {scale}, expected one of {', '.join(spectra_aggregate.GRID_SCALES)}"}
+
+    if not isinstance(bins, int) or not 1 <= bins <= MAX_AGGREGATE_BINS:
+        return {"error": f"bins must be an integer between 1 and {MAX_AGGREGATE_BINS}"}
+
+    if any(not isinstance(q, (int, float)) or not 0 <= q <= 100 for q in percentiles):
+        return {"error": "percentiles must be numbers between 0 and 100"}
+
+    index = load_spectral_index()
+    wavelengths = index['arrays'][spectrum_type]['wavelength']
+    if len(wavelengths) == 0:
+        return {"error": f"No {spectrum_type} spectra in the archive"}
+
+    wave_min, wave_max = wavelength_range or (float('-inf'), float('inf'))
+    wave_min = float(wavelengths.min()) if wave_min == float('-inf') else wave_min
+    wave_max = float(wavelengths.max()) if wave_max == float('inf') else wave_max
+    if wave_min >= wave_max:
+        return {"error": "Wavelength range minimum must be smaller than its maximum"}
+    if scale == 'log' and wave_min <= 0:
+        return {"error": "A log grid needs a positive wavelength range"}
+
+    if planet_names is not None:
+        planet_index_data = planet_index.update_planet_index("downloaded_data")
+        planet_names = [planet_index.resolve_planet_name(planet_index_data, name) or name for name in planet_names]
+
+    return spectra_aggregate.cached_aggregate(index, spectrum_type, (wave_min, wave_max), bins, scale, planet_names,
+                                              tuple(percentiles))
+
+def load_planet_catalog():
+    index = planet_index.update_planet_index("downloaded_data")
+    version = planet_index.archive_version(index)
+    if version in loaded_catalog:
+        return loaded_catalog[version]
+
+    catalog = planet_catalog.load_catalog(index)
+    if catalog is None:
+        build_archive_indexes(index)
+        catalog = planet_catalog.load_catalog(index)
+    loaded_catalog.clear()
+    loaded_catalog[version] = catalog
+    return catalog
+
+def list_planet_catalog(spectrum_types=None):
+    # Catalog rows, optionally only planets with any of spectrum_types
+    rows = load_planet_catalog()['planets']
+    if spectrum_types:
+        rows = [row for row in rows if set(row['spectrum_types']) & set(spectrum_types)]
+    return {'count': len(rows), 'planets': rows}
+
+def search_planets(query, limit=10):
+    if not query:
+        return {"error": "No search query provided"}
+    matches = planet_catalog.search_catalog(load_planet_catalog(), query, limit)
+    return {'query': query, 'count': len(matches), 'planets': matches}
+
+def planet_plot(planet_name, spectrum_type=None, size='thumbnail', fmt='png'):
+    # Absolute path of the cached plot of one spectrum type of the planet (by
+    # default its first), or a null path when it still has to be rendered.
+    # Rendering takes most of a second, so it is left to planet_plots.py
+    # --render in its own process and the worker stays free for queries.
+    # matplotlib is only imported with the first plot request.
+    import planet_plots
+
+    if size not in planet_plots.PLOT_SIZES:
+        return {"error": f"Unknown plot size {size}, expected one of {', '.join(planet_plots.PLOT_SIZES)}"}
+
+    if fmt not in planet_plots.PLOT_FORMATS:
+        return {"error": f"Unknown plot format {fmt}, expected one of {', '.join(planet_plots.PLOT_FORMATS)}"}
+
+    if not planet_name:
+        return {"error": "No planet name provided"}
+
+    index = planet_index.update_planet_index("downloaded_data")
+    pl_name = planet_index.resolve_planet_name(index, planet_name) or planet_name
+    row = next((row for row in load_planet_catalog()['planets'] if row['name'] == pl_name), None)
+    if row is None:
+        return {"error": f"Planet {planet_name} not found in the dataset"}
+
+    spectrum_type = spectrum_type or row['spectrum_types'][0]
+    if spectrum_type not in row['spectrum_types']:
+        return {"error": f"No {spectrum_type} spectrum available for {pl_name}"}
+
+    path = planet_plots.find_plot(pl_name, spectrum_type, size, fmt)
+    return {"planet": pl_name, "spectrum_type": spectrum_type, "size": size, "format": fmt,
+            "version": spectra_lod.planet_version(pl_name), "path": os.path.abspath(path) if path else None}
+
+def load_planets(planet_names, planet_data):
+    # Resolve the requested names through the planet index, merge any planets
+    # not loaded yet into planet_data and return the name to query for each.
+    index = planet_index.update_planet_index("downloaded_data")
+    resolved_names = [planet_index.resolve_planet_name(index, name) or name for name in planet_names]
+    missing = [name for name in resolved_names if name in index['planets'] and name not in planet_data]
+    if missing:
+        planet_data.update(merge_planet_data(missing))
+    return resolved_names
+
+def iter_batch_spectra(planet_names, planet_data, response_format='records', max_points=None, wavelength_range=None, keep=True,
+                       stream=False, chunk_size=STREAM_CHUNK_SIZE):
+    # Yield (planet name, get_planet_spectra() result) for each planet as soon
+    # as it is ready, or with stream every iter_planet_spectra() message in
+    # turn. Each planet is merged from its own files only, so the whole batch
+    # reads every file it needs once. keep=False drops each planet from
+    # planet_data after it is yielded, keeping memory flat for one-off runs.
+    index = planet_index.update_planet_index("downloaded_data")
+    for pl_name in planet_names:
+        if pl_name in index['planets'] and pl_name not in planet_data:
+            planet_data.update(merge_planet_data([pl_name]))
+        if stream:
+            for message in iter_planet_spectra(pl_name, planet_data, response_format, max_points, wavelength_range, chunk_size):
+                yield pl_name, message
+        else:
+            yield pl_name, get_planet_spectra(pl_name, planet_data, response_format, max_points, wavelength_range)
+        if not keep:
+            planet_data.pop(pl_name, None)
+
+def select_batch_planets(request):
+    index = planet_index.update_planet_index("downloaded_data")
+    return planet_index.select_planets(index, request.get('planets'), request.get('prefix'), request.get('host'))
+
+def request_wavelength_range(request):
+    wave_min = request.get('wave_min')
+    wave_max = request.get('wave_max')
+    if wave_min is None and wave_max is None:
+        return None
+    return (float('-inf') if wave_min is None else wave_min, float('inf') if wave_max is None else wave_max)
+
+def handle_request(request, planet_data):
+    action = request.get('action', 'spectra')
+    if action == 'metrics':
+        return instrumentation.summary()
+
+    if action == 'catalog':
+        return list_planet_catalog(request.get('types'))
+
+    if action == 'search':
+        return search_planets(request.get('query'), request.get('limit', 10))
+
+    if action == 'range':
+        return query_wavelength_range(request_wavelength_range(request), request.get('types'), request.get('planets'),
+                                      request.get('format', 'records'), request.get('summary', False))
+
+    if action == 'plot':
+        return planet_plot(request.get('planet'), request.get('type'), request.get('size', 'thumbnail'),
+                           request.get('format', 'png'))
+
+    if action == 'aggregate':
+        selected = any(request.get(key) for key in ('planets', 'prefix', 'host'))
+        return aggregate_spectra(request.get('type'), request_wavelength_range(request), request.get('bins', AGGREGATE_BINS),
+                                 request.get('scale', 'log'), select_batch_planets(request) if selected else None,
+                                 request.get('percentiles', spectra_aggregate.DEFAULT_PERCENTILES))
+
+    planet_name = request.get('planet')
+    if not planet_name:
+        return {"error": "No planet name provided"}
+    resolved_name = load_planets([planet_name], planet_data)[0]
+    return get_planet_spectra(resolved_name, planet_data, request.get('format', 'records'),
+                              request.get('max_points'), request_wavelength_range(request))
+
+def handle_stream_request(request, planet_data):
+    # One {"id", "item": chunk} message per chunk, then a final {"id", "result"}
+    # holding the point counts (or the error)
+    request_id = request.get('id')
+    planet_name = request.get('planet')
+    if not planet_name:
+        yield {"id": request_id, "result": {"error": "No planet name provided"}}
+        return
+
+    resolved_name = load_planets([planet_name], planet_data)[0]
+    for message in iter_planet_spectra(resolved_name, planet_data, request.get('format', 'records'), request.get('max_points'),
+                                       request_wavelength_range(request), request.get('chunk_size', STREAM_CHUNK_SIZE)):
+        if 'spectrum_type' in message:
+            yield {"id": request_id, "item": message}
+        else:
+            yield {"id": request_id, "result": message}
+
+def handle_batch_request(request, planet_data):
+    # One {"id", "item": {"planet", "result"}} message per planet as it is
+    # ready, then a final {"id", "result"} with the planets that were sent.
+    # With "stream": true every item is one {"planet", ...} chunk or summary
+    # from iter_planet_spectra() instead.
+    request_id = request.get('id')
+    response_format = request.get('format', 'records')
+    max_points = request.get('max_points')
+    wavelength_range = request_wavelength_range(request)
+    stream = request.get('stream', False)
+
+    options_error = spectra_options_error(response_format, max_points, wavelength_range)
+    if options_error:
+        yield {"id": request_id, "result": options_error}
+        return
+
+    planet_names = select_batch_planets(request)
+    if not planet_names:
+        yield {"id": request_id, "result": {"error": "No planets match the batch request"}}
+        return
+
+    for pl_name, result in iter_batch_spectra(planet_names, planet_data, response_format, max_points, wavelength_range,
+                                              stream=stream, chunk_size=request.get('chunk_size', STREAM_CHUNK_SIZE)):
+        if stream:
+            yield {"id": request_id, "item": {"planet": pl_name, **result}}
+        else:
+            yield {"id": request_id, "item": {"planet": pl_name, "result": result}}
+    yield {"id": request_id, "result": {"planets": planet_names}}
+
+def iter_responses(request, planet_data):
+    if request.get('action') == 'batch':
+        yield from handle_batch_request(request, planet_data)
+    elif request.get('stream'):
+        yield from handle_stream_request(request, planet_data)
+    else:
+        yield {"id": request.get('id'), "result": handle_request(request, planet_data)}
+
+def write_message(message):
+    with stage('serialise'):
+        line = json.dumps(message, cls=NaNEncoder)
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+def serve():
+    # Worker mode: keep merged planets in memory across requests and answer
+    # one JSON request per stdin line with one JSON response per stdout line.
+    # Requests look like {"id": 1, "planet": "GJ 1214 b", "format": "columnar"};
+    # format, max_points, wave_min and wave_max are optional and the id is
+    # echoed back. {"action": "range", "wave_min": 1.1, "wave_max": 1.7} asks
+    # for every planet with data in that range, optionally narrowed by
+    # "types" and "planets" lists, or just counts with "summary": true.
+    # {"action": "batch", "planets": [...], "prefix": "WASP", "host": "TRAPPIST-1"}
+    # streams the spectra of every selected planet, see handle_batch_request().
+    # "stream": true on a planet or batch request sends the spectra in chunks,
+    # see handle_stream_request().
+    # {"action": "catalog"} lists the planet catalog (optionally only "types")
+    # and {"action": "search", "query": "wasp 39"} searches it.
+    # {"action": "aggregate", "type": "transmission", "bins": 50} returns
+    # per-bin statistics across planets, see aggregate_spectra(); wave_min,
+    # wave_max, "scale", "percentiles" and a planets/prefix/host selection are
+    # optional.
+    # {"action": "plot", "planet": "WASP-39 b", "type": "transmission",
+    # "size": "thumbnail", "format": "png"} returns the path of a cached plot,
+    # or a null path if it has not been rendered yet, see planet_plot().
+    # {"action": "metrics"} returns the worker's stage timings and counters,
+    # which are also logged when stdin closes.
+    # Planets are merged on first request, reading only their own files, and
+    # dropped again when the archive version changes, whether the worker ran
+    # the downloader or the files were changed by other means.
+    if check_update_needed():
+        log.info("Data update needed. Running downloader...")
+        run_downloader(exit_on_failure=False)
+    last_update_attempt = time.monotonic()
+
+    planet_data = {}
+    data_version = planet_index.archive_version(planet_index.update_planet_index("downloaded_data"))
+    log.info("Worker ready.")
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+
+            if time.monotonic() - last_update_attempt >= UPDATE_RETRY_MINUTES * 60 and check_update_needed():
+                log.info("Data update needed. Running downloader...")
+                run_downloader(exit_on_failure=False)
+                last_update_attempt = time.monotonic()
+
+            version = planet_index.archive_version(planet_index.update_planet_index("downloaded_data"))
+            if version != data_version:
+                log.info("Archive changed, dropping %d merged planets", len(planet_data))
+                planet_data = {}
+                data_version = version
+
+            instrumentation.count('requests')
+            with stage('request'):
+                for message in iter_responses(request, planet_data):
+                    write_message(message)
+            log.debug("Handled request %s", request_id)
+        except Exception as e:
+            error_message = f"Error processing request {line}: {str(e)}\n{traceback.format_exc()}"
+            instrumentation.count('request_errors')
+            log.error(error_message)
+            write_message({"id": request_id, "error": error_message})
+
+    instrumentation.log_summary(log)
 
 if __name__ == "__main__":
-    print("Entering main block", file=sys.stderr)
-    if len(sys.argv) > 1:
-        planet_name = sys.argv[1]
-        print(f"Searching for planet: {planet_name}", file=sys.stderr)
+    log.debug("Entering main block")
+    parser = argparse.ArgumentParser(description="Return the spectra of an exoplanet as JSON")
+    parser.add_argument('planet', nargs='?', help="planet name, e.g. 'GJ 1214 b'")
+    parser.add_argument('--serve', action='store_true', help="answer JSON requests on stdin until it closes")
+    parser.add_argument('--format', choices=RESPONSE_FORMATS, default='records', help="response encoding")
+    parser.add_argument('--max-points', type=int, help="decimate each reference's series to this many points")
+    parser.add_argument('--wave-min', type=float, help="shortest wavelength to return (microns)")
+    parser.add_argument('--wave-max', type=float, help="longest wavelength to return (microns)")
+    parser.add_argument('--ndjson', action='store_true', help="stream chunks of points as newline-delimited JSON")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE, help="points per --ndjson chunk")
+    parser.add_argument('--planets', help="comma-separated planet names to return in one batch")
+    parser.add_argument('--prefix', help="batch every planet whose name starts with this")
+    parser.add_argument('--host', help="batch every planet of this host star")
+    parser.add_argument('--catalog', action='store_true', help="list every planet with spectra and its summary")
+    parser.add_argument('--search', help="search planet names and aliases in the catalog")
+    parser.add_argument('--all-planets', action='store_true', help="return every planet with data in the wavelength range")
+    parser.add_argument('--type', action='append', choices=list(SPECTRUM_VALUE_COLUMNS), help="spectrum type for --all-planets and --catalog, repeatable")
+    parser.add_argument('--summary', action='store_true', help="with --all-planets, only count points per planet")
+    parser.add_argument('--aggregate', choices=list(SPECTRUM_VALUE_COLUMNS), help="per-bin statistics of this spectrum type across planets")
+    parser.add_argument('--bins', type=int, default=AGGREGATE_BINS, help="wavelength bins for --aggregate")
+    parser.add_argument('--scale', choices=spectra_aggregate.GRID_SCALES, default='log', help="wavelength grid spacing for --aggregate")
+    args = parser.parse_args()
+
+    # Planets selected by --planets, --prefix or --host
+    selection = {
+        'planets': args.planets.split(',') if args.planets else None,
+        'prefix': args.prefix,
+        'host': args.host
+    }
+    selected = any(selection.values())
+
+    # One-shot commands refresh stale data first; the worker checks between requests
+    if not args.serve and (args.catalog or args.search or args.all_planets or args.aggregate or selected or args.planet):
+        if check_update_needed():
+            log.info("Data update needed. Running downloader...")
+            run_downloader()
+
+    if args.serve:
+        serve()
+    elif args.catalog or args.search:
+        result = search_planets(args.search) if args.search else list_planet_catalog(args.type)
+        print(json.dumps(result, cls=NaNEncoder))
+    elif args.all_planets:
+        wavelength_range = request_wavelength_range({'wave_min': args.wave_min, 'wave_max': args.wave_max})
+        print(json.dumps(query_wavelength_range(wavelength_range, args.type, None, args.format, args.summary), cls=NaNEncoder))
+    elif args.aggregate:
+        wavelength_range = request_wavelength_range({'wave_min': args.wave_min, 'wave_max': args.wave_max})
+        planet_names = select_batch_planets(selection) if selected else None
+        print(json.dumps(aggregate_spectra(args.aggregate, wavelength_range, args.bins, args.scale, planet_names), cls=NaNEncoder))
+    elif selected:
+        # One JSON line per planet, written as soon as that planet is ready
+        wavelength_range = request_wavelength_range({'wave_min': args.wave_min, 'wave_max': args.wave_max})
+        planet_names = select_batch_planets(selection)
+        for pl_name, result in iter_batch_spectra(planet_names, {}, args.format, args.max_points, wavelength_range,
+                                                  keep=False, stream=args.ndjson, chunk_size=args.chunk_size):
+            message = {"planet": pl_name, **result} if args.ndjson else {"planet": pl_name, "result": result}
+            print(json.dumps(message, cls=NaNEncoder), flush=True)
+    elif args.planet:
+        planet_name = args.planet
+        log.debug("Searching for planet: %s", planet_name)
         try:
-            if check_update_needed():
-                print("Data update needed. Running downloader...", file=sys.stderr)
-                run_downloader()
+            planet_data = {}
+            resolved_name = load_planets([planet_name], planet_data)[0]
+            log.debug("Planet data merged. Number of planets: %d", len(planet_data))
             
-            planet_data = merge_planet_data()
-            print(f"Planet data merged. Number of planets: {len(planet_data)}", file=sys.stderr)
-            
-            spectra = get_planet_spectra(planet_name, planet_data)
-            print(f"Spectra retrieved: {spectra}", file=sys.stderr)
-            
-            print(json.dumps(spectra, cls=NaNEncoder))
+            wavelength_range = request_wavelength_range({'wave_min': args.wave_min, 'wave_max': args.wave_max})
+            if args.ndjson:
+                # Each chunk is written as soon as it is encoded
+                for message in iter_planet_spectra(resolved_name, planet_data, args.format, args.max_points,
+                                                   wavelength_range, args.chunk_size):
+                    print(json.dumps(message, cls=NaNEncoder), flush=True)
+            else:
+                spectra = get_planet_spectra(resolved_name, planet_data, args.format, args.max_points, wavelength_range)
+                log.debug("Spectra retrieved for %s", resolved_name)
+
+                # One complete document; --ndjson streams the spectra in chunks instead
+                with stage('serialise'):
+                    print(json.dumps(spectra, cls=NaNEncoder))
         except Exception as e:
             error_message = f"Error processing spectra for {planet_name}: {str(e)}\n{traceback.format_exc()}"
             print(json.dumps({"error": error_message}), file=sys.stderr)
             sys.exit(1)
     else:
-        print(json.dumps({"error": "No planet name provided"}))
\ No newline at end of file
+        print(json.dumps({"error": "No planet name provided"}))
+
+    if not args.serve:
+        instrumentation.log_summary(log)
@@ -0,0 +1,238 @@
+import os
+import json
+import re
+import hashlib
+import instrumentation
+
+log = instrumentation.get_logger('planet_index')
+
+# Persisted index from planet name (and normalised aliases) to the .tbl files
+# that hold its spectra, so a single-planet query only opens those files.
+# Entries are keyed by file name with the size, mtime and content hash they
+# were read at, and only new or changed files are read and hashed again.
+#
+# Copies of the same file (e.g. "x.tbl" and "x (1).tbl") are resolved here,
+# once per change: byte-identical twins are ignored in favour of one
+# canonical file, and copies whose contents differ from the canonical file
+# are flagged as conflicts and left out of the planet lookups.
+#
+# The archive spells some planets more than one way (e.g. "HD 189733 b" and
+# "HD-189733 b"); files whose names normalise alike are one planet, listed
+# under the spelling most of them use.
+INDEX_FILE = "planet_index.json"
+INDEX_VERSION = 3
+
+# e.g. "GJ_1214_b_3.10969_3419_1 (1).tbl" -> "GJ_1214_b"
+FILE_PREFIX_PATTERN = re.compile(r'^(.+?)_\d+\.\d+_\d+_\d+(?:\s*\(\d+\))?\.tbl$')
+
+# e.g. "GJ_1214_b_3.10969_3419_1 (1).tbl" -> "GJ_1214_b_3.10969_3419_1.tbl"
+COPY_SUFFIX_PATTERN = re.compile(r'\s*\(\d+\)(?=\.tbl$)')
+
+# e.g. "TRAPPIST-1 e" -> "TRAPPIST-1"; the .tbl files carry no host star field
+PLANET_LETTER_PATTERN = re.compile(r'\s+[a-z]$')
+
+def get_pl_name(filename):
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('\\PL_NAME'):
+                # Remove leading/trailing whitespace and quotes
+                pl_name = line.split('=')[1].strip().strip("'")
+                return pl_name
+    return None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def canonical_filename(filename):
+    return COPY_SUFFIX_PATTERN.sub('', filename)
+
+def normalize_planet_name(name):
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+def empty_index():
+    return {'version': INDEX_VERSION, 'files': {}, 'planets': {}, 'aliases': {}, 'ignored': {}, 'conflicts': {}}
+
+# The index last read or written with the size and mtime of INDEX_FILE it
+# matches, so the worker, which checks the index on every request, only parses
+# the JSON again after another process saved it
+loaded_index = {}
+
+def index_file_stamp():
+    stat = os.stat(INDEX_FILE)
+    return stat.st_size, stat.st_mtime_ns
+
+def load_index():
+    if not os.path.exists(INDEX_FILE):
+        return empty_index()
+
+    stamp = index_file_stamp()
+    if loaded_index.get('stamp') == stamp:
+        return loaded_index['index']
+
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not read planet index, rebuilding: %s", e)
+        return empty_index()
+
+    if index.get('version') != INDEX_VERSION:
+        return empty_index()
+
+    loaded_index.update(stamp=stamp, index=index)
+    return index
+
+def save_index(index):
+    tmp_file = INDEX_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_file, INDEX_FILE)
+    loaded_index.update(stamp=index_file_stamp(), index=index)
+
+def resolve_copies(files):
+    # Returns {ignored file: file it duplicates} and {conflicting file: canonical file}
+    ignored = {}
+    conflicts = {}
+
+    # Byte-identical files are the same data whatever they are called; the
+    # copy without a "(n)" suffix (then the first by name) is kept
+    by_hash = {}
+    for filename in sorted(files, key=lambda name: (canonical_filename(name) != name, name)):
+        sha256 = files[filename]['sha256']
+        if sha256 in by_hash:
+            ignored[filename] = by_hash[sha256]
+        else:
+            by_hash[sha256] = filename
+
+    # Remaining copies of one file that disagree on content cannot be merged safely
+    groups = {}
+    for filename in sorted(files):
+        if filename not in ignored:
+            groups.setdefault(canonical_filename(filename), []).append(filename)
+    for base_name, group in groups.items():
+        keep = base_name if base_name in group else group[0]
+        for filename in group:
+            if filename != keep:
+                conflicts[filename] = keep
+
+    return ignored, conflicts
+
+def rebuild_lookups(index):
+    ignored, conflicts = resolve_copies(index['files'])
+    for filename, keep in conflicts.items():
+        if filename not in index['conflicts']:
+            log.warning("%s differs from %s; using %s only", filename, keep, keep)
+
+    spellings = {}
+    for filename, entry in sorted(index['files'].items()):
+        if filename in ignored or filename in conflicts:
+            continue
+        pl_name = entry['pl_name']
+        if not pl_name:
+            continue
+        spellings.setdefault(normalize_planet_name(pl_name), {}).setdefault(pl_name, []).append(filename)
+
+    planets = {}
+    aliases = {}
+    for key, files_by_name in sorted(spellings.items()):
+        pl_name = max(sorted(files_by_name), key=lambda name: len(files_by_name[name]))
+        if len(files_by_name) > 1:
+            others = ', '.join(name for name in sorted(files_by_name) if name != pl_name)
+            log.info("Files for %s are listed under %s", others, pl_name)
+        planets[pl_name] = sorted(filename for files in files_by_name.values() for filename in files)
+        aliases[key] = pl_name
+
+    for pl_name, files in planets.items():
+        for filename in files:
+            match = FILE_PREFIX_PATTERN.match(filename)
+            if match:
+                aliases.setdefault(normalize_planet_name(match.group(1)), pl_name)
+
+    index['planets'] = planets
+    index['aliases'] = aliases
+    index['ignored'] = ignored
+    index['conflicts'] = conflicts
+
+def update_planet_index(download_dir):
+    index = load_index()
+    changed = False
+
+    present_files = set()
+    for filename in os.listdir(download_dir):
+        if not filename.endswith('.tbl'):
+            continue
+        present_files.add(filename)
+
+        path = os.path.join(download_dir, filename)
+        stat = os.stat(path)
+        entry = index['files'].get(filename)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            continue
+
+        index['files'][filename] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'pl_name': get_pl_name(path),
+            'sha256': file_sha256(path)
+        }
+        changed = True
+
+    for filename in [name for name in index['files'] if name not in present_files]:
+        del index['files'][filename]
+        changed = True
+
+    if changed:
+        rebuild_lookups(index)
+        save_index(index)
+
+    return index
+
+def resolve_planet_name(index, name):
+    if name in index['planets']:
+        return name
+    return index['aliases'].get(normalize_planet_name(name))
+
+def archive_version(index):
+    # Changes whenever any indexed file changes, or the way files are grouped
+    # into planets; keys derived caches
+    digest = hashlib.sha256(str(INDEX_VERSION).encode())
+    for filename, entry in sorted(index['files'].items()):
+        digest.update(filename.encode())
+        digest.update(entry['sha256'].encode())
+    return digest.hexdigest()[:16]
+
+def excluded_files(index):
+    return set(index['ignored']) | set(index['conflicts'])
+
+def files_for_planet(index, name):
+    pl_name = resolve_planet_name(index, name)
+    if pl_name is None:
+        return []
+    return index['planets'][pl_name]
+
+def host_star(pl_name):
+    return PLANET_LETTER_PATTERN.sub('', pl_name)
+
+def select_planets(index, names=None, prefix=None, host=None):
+    # Planet names matching any of the given names, name prefix or host star,
+    # in that order and without repeats. Names that resolve to no planet are
+    # kept as given so the caller can report them.
+    selected = []
+    for name in names or []:
+        selected.append(resolve_planet_name(index, name) or name)
+
+    if prefix:
+        normalized_prefix = normalize_planet_name(prefix)
+        selected.extend(pl_name for pl_name in sorted(index['planets'])
+                        if normalize_planet_name(pl_name).startswith(normalized_prefix))
+
+    if host:
+        normalized_host = normalize_planet_name(host)
+        selected.extend(pl_name for pl_name in sorted(index['planets'])
+                        if normalize_planet_name(host_star(pl_name)) == normalized_host)
+
+    return list(dict.fromkeys(selected))
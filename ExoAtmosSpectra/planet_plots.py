@@ -0,0 +1,263 @@
+import os
+import re
+import argparse
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import planet_index
+import planet_catalog
+import spectra_lod
+import tbl_cache
+import instrumentation
+from instrumentation import stage
+from spectra_encoding import SPECTRUM_VALUE_COLUMNS, SPECTRUM_ERROR_COLUMNS
+
+log = instrumentation.get_logger('planet_plots')
+
+# Plotting for exploring the archive from a terminal, and headless rendering
+# of spectra plots for the server. Kept out of planet_data_viewer.py so the
+# JSON entry point used by server.js only imports matplotlib when a plot is
+# requested.
+
+# Paths are relative to the ExoAtmosSpectra folder, as in planet_data_viewer.py
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+# Headless plots are drawn on the Agg canvas, one figure per spectrum type,
+# and cached as PNG or SVG under parsed_cache/plots/<planet>/, named by the
+# planet's data version (spectra_lod.planet_version()) so a plot is redrawn
+# only when one of the planet's files changes. Once the cache grows past
+# EXOATMOS_PLOT_CACHE_MB the least recently used plots are removed.
+PLOT_DIR = os.path.join(tbl_cache.CACHE_DIR, "plots")
+PLOT_CACHE_MAX_BYTES = int(os.environ.get('EXOATMOS_PLOT_CACHE_MB', '256')) * 1024 * 1024
+PLOT_FORMATS = ('png', 'svg')
+
+# (figure size in inches, dpi, points per reference series or None for all);
+# thumbnails are min/max decimated and drawn without error bars or legend
+PLOT_SIZES = {
+    'full': ((12, 6), 100, None),
+    'thumbnail': ((4, 2.5), 64, 512)
+}
+
+# Columns read on top of merge_planet_data()'s compact store for error bars
+PLOT_COLUMNS = ('BANDWIDTH',) + tuple(col for columns in SPECTRUM_ERROR_COLUMNS.values() for col in columns)
+
+SPECTRUM_LABELS = {
+    'transmission': ('Transit Depth (%)', 'Transmission Spectrum'),
+    'eclipse': ('Eclipse Depth (%)', 'Eclipse Spectrum'),
+    'direct_imaging': ('F_Lambda (W/(m^2 microns))', 'Direct Imaging Spectrum')
+}
+
+def spectrum_frames(df):
+    # Per spectrum type, the rows of the merged frame that have its value
+    wavelength_column = next((col for col in df.columns if 'WAVE' in col.upper()), None)
+    frames = {}
+    for spectrum_type, value_column in SPECTRUM_VALUE_COLUMNS.items():
+        if wavelength_column and value_column in df.columns:
+            frame = df[df[wavelength_column].notna() & df[value_column].notna()]
+            if not frame.empty:
+                frames[spectrum_type] = frame
+    return frames, wavelength_column
+
+def draw_spectrum(ax, frame, wavelength_column, spectrum_type, pl_name, max_points=None):
+    # One series per reference; error bars from the +/- uncertainties and half
+    # the bandwidth unless the series is decimated
+    value_column = SPECTRUM_VALUE_COLUMNS[spectrum_type]
+    upper_column, lower_column = SPECTRUM_ERROR_COLUMNS[spectrum_type]
+    for reference, group in frame.groupby('REFERENCE', sort=True, observed=True):
+        x = group[wavelength_column].to_numpy(dtype=np.float64)
+        y = group[value_column].to_numpy(dtype=np.float64)
+        if max_points is not None:
+            keep = spectra_lod.minmax_indices(y, max_points)
+            ax.plot(x[keep], y[keep], 'o', markersize=2, label=reference)
+            continue
+
+        yerr = None
+        if upper_column in group.columns and lower_column in group.columns:
+            yerr = np.abs(group[[lower_column, upper_column]].to_numpy(dtype=np.float64).T)
+            yerr = np.nan_to_num(yerr)
+        xerr = np.nan_to_num(group['BANDWIDTH'].to_numpy(dtype=np.float64) / 2) if 'BANDWIDTH' in group.columns else None
+        ax.errorbar(x, y, xerr=xerr, yerr=yerr, fmt='o', markersize=3, label=reference)
+
+    ylabel, title = SPECTRUM_LABELS[spectrum_type]
+    if max_points is None:
+        ax.set_xlabel('Central Wavelength (microns)')
+        ax.set_ylabel(ylabel)
+        ax.set_title(f'{title} for {pl_name}')
+        ax.legend(fontsize='small')
+    else:
+        ax.set_title(pl_name, fontsize='small')
+        ax.tick_params(labelsize='x-small')
+
+def render_figure(frame, wavelength_column, spectrum_type, pl_name, size, fmt, path):
+    figsize, dpi, max_points = PLOT_SIZES[size]
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    draw_spectrum(figure.add_subplot(), frame, wavelength_column, spectrum_type, pl_name, max_points)
+    figure.tight_layout()
+
+    tmp_path = f"{path}.tmp"
+    figure.savefig(tmp_path, format=fmt)
+    os.replace(tmp_path, path)
+
+def planet_plot_dir(pl_name):
+    return os.path.join(PLOT_DIR, re.sub(r'[^A-Za-z0-9]+', '_', pl_name))
+
+def plot_path(pl_name, version, spectrum_type, size, fmt):
+    return os.path.join(planet_plot_dir(pl_name), f"{version}_{spectrum_type}_{size}.{fmt}")
+
+def find_plot(pl_name, spectrum_type, size, fmt):
+    # Path of the cached plot for the planet's current data, or None
+    path = plot_path(pl_name, spectra_lod.planet_version(pl_name), spectrum_type, size, fmt)
+    if not os.path.exists(path):
+        return None
+    # The modification time orders plots for eviction
+    os.utime(path)
+    instrumentation.count('plot_cache_hits')
+    return path
+
+def evict_plots(max_bytes=PLOT_CACHE_MAX_BYTES):
+    # Remove the least recently used plots until the cache fits in max_bytes
+    plots = []
+    for directory, _, filenames in os.walk(PLOT_DIR):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            plots.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in plots)
+    for _, size, path in sorted(plots):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        instrumentation.count('plots_evicted')
+        log.debug("Evicted plot %s", path)
+
+def render_planet_plots(pl_name, data, sizes=('full',), formats=('png',), spectrum_types=None):
+    # Render every spectrum type (or spectrum_types) of one merge_planet_data()
+    # planet in each size and format, replacing plots of older versions of its data.
+    # Returns {spectrum type: {(size, format): path}}.
+    df = data.get('merged_data')
+    if df is None:
+        return {}
+    frames, wavelength_column = spectrum_frames(df)
+
+    version = spectra_lod.planet_version(pl_name)
+    directory = planet_plot_dir(pl_name)
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if not filename.startswith(version + '_'):
+            os.remove(os.path.join(directory, filename))
+
+    paths = {}
+    with stage('render'):
+        for spectrum_type, frame in frames.items():
+            if spectrum_types is not None and spectrum_type not in spectrum_types:
+                continue
+            for size in sizes:
+                for fmt in formats:
+                    path = plot_path(pl_name, version, spectrum_type, size, fmt)
+                    render_figure(frame, wavelength_column, spectrum_type, pl_name, size, fmt, path)
+                    instrumentation.count('plots_rendered')
+                    paths.setdefault(spectrum_type, {})[(size, fmt)] = path
+
+    evict_plots()
+    return paths
+
+def render_archive(sizes=('full', 'thumbnail'), formats=('png',), planet_names=None, spectrum_types=None):
+    # Batch-render plots of every spectrum type (or spectrum_types) for every
+    # planet in the catalog (or planet_names), merging one planet at a time and
+    # skipping planets whose plots are cached. The server runs this with one
+    # planet, type, size and format for a plot missing from the cache.
+    from planet_data_viewer import merge_planet_data, load_planet_catalog
+
+    rows = load_planet_catalog()['planets']
+    if planet_names is not None:
+        wanted = set(planet_names)
+        rows = [row for row in rows if row['name'] in wanted]
+
+    rendered = 0
+    for row in rows:
+        pl_name = row['name']
+        types = [spectrum_type for spectrum_type in row['spectrum_types'] if spectrum_types is None or spectrum_type in spectrum_types]
+        if all(find_plot(pl_name, spectrum_type, size, fmt) for spectrum_type in types for size in sizes for fmt in formats):
+            continue
+        data = merge_planet_data([pl_name], extra_columns=PLOT_COLUMNS)
+        if pl_name in data:
+            render_planet_plots(pl_name, data[pl_name], sizes, formats, types)
+            rendered += 1
+            log.debug("Rendered plots for %s", pl_name)
+
+    log.info("Rendered plots for %d of %d planets", rendered, len(rows))
+    total = sum(os.path.getsize(os.path.join(directory, filename))
+                for directory, _, filenames in os.walk(PLOT_DIR) for filename in filenames)
+    if total >= PLOT_CACHE_MAX_BYTES * 0.9:
+        log.warning("Plot cache is near its %d MB limit; raise EXOATMOS_PLOT_CACHE_MB to keep every plot",
+                    PLOT_CACHE_MAX_BYTES // (1024 * 1024))
+
+def search_planet(planet_data):
+    import matplotlib.pyplot as plt
+
+    search_term = input("Enter a planet name to search for: ")
+
+    from planet_data_viewer import load_planet_catalog
+
+    catalog = load_planet_catalog()
+    matching_planets = [row['name'] for row in planet_catalog.search_catalog(catalog, search_term) if row['name'] in planet_data]
+
+    if not matching_planets:
+        print("No matching planets found.")
+        return
+
+    if len(matching_planets) > 1:
+        print(f"Found {len(matching_planets)} matching planets. Displaying data for the first match.")
+
+    selected_planet = matching_planets[0]
+    df = planet_data[selected_planet]['merged_data']
+    metadata = planet_data[selected_planet]['metadata'][0]  # Using metadata from the first file
+
+    print(f"\nData for {selected_planet}:")
+    print(f"Number of data points: {len(df)}")
+    print(df)
+
+    wavelength_column = next((col for col in df.columns if 'WAVE' in col.upper()), None)
+    if wavelength_column:
+        print(f"\nWavelength range: {df[wavelength_column].min()} to {df[wavelength_column].max()}")
+    else:
+        print("\nNo wavelength column found in the data.")
+
+    print("\nMetadata:")
+    for key, value in metadata.items():
+        print(f"{key}: {value}")
+
+    # One figure per spectrum type, all shown together
+    frames, wavelength_column = spectrum_frames(df)
+    for spectrum_type in SPECTRUM_VALUE_COLUMNS:
+        if spectrum_type not in frames:
+            print(f"Not enough data to plot {SPECTRUM_LABELS[spectrum_type][1].lower()}.")
+            continue
+        figure, ax = plt.subplots(figsize=PLOT_SIZES['full'][0])
+        draw_spectrum(ax, frames[spectrum_type], wavelength_column, spectrum_type, selected_planet)
+    if frames:
+        plt.show()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plot exoplanet spectra interactively or render them to the plot cache")
+    parser.add_argument('--render', action='append', metavar='PLANET', help="render this planet's plots headlessly, repeatable")
+    parser.add_argument('--all', action='store_true', help="render plots for every planet in the archive")
+    parser.add_argument('--size', action='append', choices=list(PLOT_SIZES), help="plot size to render, repeatable (default: all)")
+    parser.add_argument('--format', action='append', choices=PLOT_FORMATS, help="image format to render, repeatable (default: png)")
+    parser.add_argument('--type', action='append', choices=list(SPECTRUM_VALUE_COLUMNS), help="spectrum type to render, repeatable (default: all)")
+    args = parser.parse_args()
+
+    if args.render or args.all:
+        planet_names = None
+        if args.render:
+            index = planet_index.update_planet_index("downloaded_data")
+            planet_names = [planet_index.resolve_planet_name(index, name) or name for name in args.render]
+        render_archive(tuple(args.size or PLOT_SIZES), tuple(args.format or ('png',)), planet_names, args.type)
+        instrumentation.log_summary(log)
+    else:
+        from planet_data_viewer import merge_planet_data
+        planet_data = merge_planet_data(compact=False)
+        search_planet(planet_data)
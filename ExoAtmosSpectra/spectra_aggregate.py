@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+import numpy as np
+import tbl_cache
+import instrumentation
+from spectra_encoding import NaNEncoder
+
+log = instrumentation.get_logger('spectra_aggregate')
+
+# Archive-wide statistics of one spectrum type on a common wavelength grid,
+# computed from the spectral index arrays in a single vectorised pass. A
+# point covers CENTRALWAVELNG +/- BANDWIDTH / 2 and contributes to every bin
+# it overlaps in proportion to the overlap; points without a bandwidth fall
+# in the bin holding their wavelength. Per bin this gives the number of
+# contributing points and planets, the overlap-weighted mean, the
+# inverse-variance weighted mean (from the mean of |ERR1| and |ERR2|) with
+# its uncertainty, and percentiles of the contributing values. Results are
+# cached on disk under the archive version, so they are recomputed only when
+# the underlying files change. The parameters come from API clients, so once
+# the cache grows past EXOATMOS_AGGREGATE_CACHE_MB the least recently used
+# results are removed.
+AGGREGATE_DIR = os.path.join(tbl_cache.CACHE_DIR, "aggregates")
+AGGREGATE_CACHE_MAX_BYTES = int(os.environ.get('EXOATMOS_AGGREGATE_CACHE_MB', '64')) * 1024 * 1024
+DEFAULT_PERCENTILES = (16, 50, 84)
+GRID_SCALES = ('log', 'linear')
+
+def make_grid(wave_min, wave_max, bins, scale='log'):
+    if scale == 'log':
+        return np.geomspace(wave_min, wave_max, bins + 1)
+    return np.linspace(wave_min, wave_max, bins + 1)
+
+def bin_contributions(wavelength, bandwidth, edges):
+    # (point index, bin index, overlap fraction) for every bin each point overlaps
+    bins = len(edges) - 1
+    half = np.where(np.isnan(bandwidth), 0.0, np.abs(bandwidth) / 2)
+    low = wavelength - half
+    high = wavelength + half
+    width = high - low
+
+    # The grid's upper edge belongs to its last bin
+    first = np.searchsorted(edges, low, side='right') - 1
+    first = np.where(low == edges[-1], bins - 1, first)
+    last = np.where(width > 0, np.searchsorted(edges, high, side='left') - 1, first)
+    first = np.maximum(first, 0)
+    last = np.minimum(last, bins - 1)
+    spans = np.where(last >= first, last - first + 1, 0)
+
+    point = np.repeat(np.arange(len(wavelength)), spans)
+    starts = np.cumsum(spans) - spans
+    bin_index = first[point] + np.arange(len(point)) - starts[point]
+
+    overlap = np.minimum(high[point], edges[bin_index + 1]) - np.maximum(low[point], edges[bin_index])
+    fraction = np.where(width[point] > 0, overlap / np.where(width[point] > 0, width[point], 1.0), 1.0)
+    return point, bin_index, fraction
+
+def bin_percentiles(bin_index, values, bins, percentiles):
+    # Linearly interpolated percentiles of the values in each bin, NaN for empty bins
+    order = np.lexsort((values, bin_index))
+    sorted_values = values[order]
+    counts = np.bincount(bin_index, minlength=bins)
+    starts = np.cumsum(counts) - counts
+
+    results = {}
+    for q in percentiles:
+        position = starts + (counts - 1) * (q / 100)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        filled = counts > 0
+        result = np.full(bins, np.nan)
+        lower, upper, position = lower[filled], upper[filled], position[filled]
+        result[filled] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+        results[q] = result
+    return results
+
+def aggregate_points(points, planet_codes, edges, percentiles):
+    bins = len(edges) - 1
+    point, bin_index, fraction = bin_contributions(points['wavelength'], points['bandwidth'], edges)
+    values = points['value'][point]
+    errors = points['error'][point]
+    planets = planet_codes[point]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse_variance = np.where((errors > 0) & np.isfinite(errors), fraction / errors ** 2, 0.0)
+
+        weight_sum = np.bincount(bin_index, fraction, minlength=bins)
+        mean = np.bincount(bin_index, fraction * values, minlength=bins) / weight_sum
+        inverse_variance_sum = np.bincount(bin_index, inverse_variance, minlength=bins)
+        weighted_mean = np.bincount(bin_index, inverse_variance * values, minlength=bins) / inverse_variance_sum
+        weighted_error = 1 / np.sqrt(inverse_variance_sum)
+
+    # Distinct planets per bin
+    pairs = np.unique(bin_index.astype(np.int64) * (int(planet_codes.max(initial=0)) + 1) + planets)
+    planet_counts = np.bincount(pairs // (int(planet_codes.max(initial=0)) + 1), minlength=bins)
+
+    return {
+        'points': np.bincount(bin_index, minlength=bins).tolist(),
+        'planets': planet_counts.tolist(),
+        'mean': mean.tolist(),
+        'weighted_mean': weighted_mean.tolist(),
+        'weighted_error': weighted_error.tolist(),
+        'percentiles': {str(q): values.tolist() for q, values in bin_percentiles(bin_index, values, bins, percentiles).items()},
+        'total_points': len(np.unique(point)),
+        'total_planets': len(np.unique(planets))
+    }
+
+def aggregate(spectral_index, spectrum_type, wavelength_range, bins, scale='log', planets=None, percentiles=DEFAULT_PERCENTILES):
+    edges = make_grid(wavelength_range[0], wavelength_range[1], bins, scale)
+    points = spectral_index['arrays'][spectrum_type]
+    offsets = spectral_index['offsets'][spectrum_type]
+    planet_codes = np.repeat(np.arange(len(spectral_index['planets'])), np.diff(offsets))
+
+    # Only points whose band reaches into the grid, of the requested planets
+    half = np.where(np.isnan(points['bandwidth']), 0.0, np.abs(points['bandwidth']) / 2)
+    keep = (points['wavelength'] + half >= edges[0]) & (points['wavelength'] - half <= edges[-1])
+    if planets is not None:
+        codes = [spectral_index['planet_codes'][name] for name in planets if name in spectral_index['planet_codes']]
+        keep &= np.isin(planet_codes, codes)
+    selected = np.asarray(points[keep])
+
+    with instrumentation.stage('aggregate'):
+        result = aggregate_points(selected, planet_codes[keep], edges, percentiles)
+
+    result.update({
+        'spectrum_type': spectrum_type,
+        'scale': scale,
+        'bin_edges': edges.tolist(),
+        'bin_centers': (np.sqrt(edges[:-1] * edges[1:]) if scale == 'log' else (edges[:-1] + edges[1:]) / 2).tolist()
+    })
+    return result
+
+def cache_key(version, spectrum_type, wavelength_range, bins, scale, planets, percentiles):
+    parameters = json.dumps([spectrum_type, list(wavelength_range), bins, scale, sorted(planets) if planets is not None else None,
+                             list(percentiles)])
+    return f"{version}_{hashlib.sha256(parameters.encode()).hexdigest()[:16]}"
+
+def evict_aggregates(max_bytes=AGGREGATE_CACHE_MAX_BYTES):
+    # Remove the least recently used results until the cache fits in max_bytes
+    results = []
+    for filename in os.listdir(AGGREGATE_DIR):
+        stat = os.stat(os.path.join(AGGREGATE_DIR, filename))
+        results.append((stat.st_mtime, stat.st_size, filename))
+
+    total = sum(size for _, size, _ in results)
+    for _, size, filename in sorted(results):
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(AGGREGATE_DIR, filename))
+        total -= size
+        instrumentation.count('aggregates_evicted')
+        log.debug("Evicted aggregate %s", filename)
+
+def cached_aggregate(spectral_index, spectrum_type, wavelength_range, bins, scale='log', planets=None, percentiles=DEFAULT_PERCENTILES):
+    version = spectral_index['version']
+    path = os.path.join(AGGREGATE_DIR, cache_key(version, spectrum_type, wavelength_range, bins, scale, planets, percentiles) + '.json')
+    if os.path.exists(path):
+        instrumentation.count('aggregate_cache_hits')
+        # The modification time orders results for eviction
+        os.utime(path)
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    instrumentation.count('aggregate_cache_misses')
+    result = aggregate(spectral_index, spectrum_type, wavelength_range, bins, scale, planets, percentiles)
+
+    # Results for older versions of the archive can never be hit again
+    os.makedirs(AGGREGATE_DIR, exist_ok=True)
+    for filename in os.listdir(AGGREGATE_DIR):
+        if not filename.startswith(version + '_'):
+            os.remove(os.path.join(AGGREGATE_DIR, filename))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f, cls=NaNEncoder)
+    os.replace(tmp_path, path)
+    log.debug("Cached aggregate %s", os.path.basename(path))
+    evict_aggregates()
+    return result
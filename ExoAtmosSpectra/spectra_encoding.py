@@ -0,0 +1,125 @@
+import json
+import math
+import base64
+import numpy as np
+
+# Response encodings for get_planet_spectra().
+#
+#   records   - one dict per point, as the frontend originally consumed it
+#   columnar  - per spectrum type, parallel 'wavelength' / 'value' arrays and a
+#               'reference' array of indexes into a shared 'references' list
+#   binary    - columnar, with the arrays as base64 little-endian float32
+#               (wavelength, value) and uint16/uint32 (reference) buffers
+#
+# iter_spectra_chunks() streams the same data as a sequence of small messages,
+# each holding up to chunk_size points of one reference of one spectrum type.
+RESPONSE_FORMATS = ('records', 'columnar', 'binary')
+
+SPECTRUM_VALUE_COLUMNS = {
+    'transmission': 'PL_TRANDEP',
+    'eclipse': 'ESPECLIPDEP',
+    'direct_imaging': 'FLAM'
+}
+
+# Upper and lower uncertainty of each spectrum type's value
+SPECTRUM_ERROR_COLUMNS = {
+    'transmission': ('PL_TRANDEPERR1', 'PL_TRANDEPERR2'),
+    'eclipse': ('ESPECLIPDEPERR1', 'ESPECLIPDEPERR2'),
+    'direct_imaging': ('FLAMERR1', 'FLAMERR2')
+}
+
+def replace_nan(obj):
+    if isinstance(obj, float) and (math.isnan(obj) or math.isinf(obj)):
+        return None
+    if isinstance(obj, dict):
+        return {key: replace_nan(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_nan(value) for value in obj]
+    return obj
+
+class NaNEncoder(json.JSONEncoder):
+    # json only calls default() for objects it cannot serialise, never for
+    # floats, so NaN and infinities are swapped for null before encoding.
+    # Plain json.dumps would write NaN, which JSON.parse rejects.
+    def iterencode(self, obj, _one_shot=False):
+        return super().iterencode(replace_nan(obj), _one_shot)
+
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+def encode_spectra(frames, wavelength_column, response_format):
+    # frames maps spectrum type to a DataFrame with the wavelength, value and
+    # REFERENCE columns, already free of missing values; absent types are empty
+    if response_format == 'records':
+        return {
+            spectrum_type: frames[spectrum_type].to_dict('records') if spectrum_type in frames else []
+            for spectrum_type in SPECTRUM_VALUE_COLUMNS
+        }
+
+    # References are shared by every spectrum type, so codes are assigned
+    # for all types before the width of the binary code arrays is known
+    references = []
+    reference_codes = {}
+    codes = {}
+    for spectrum_type, df in frames.items():
+        type_codes = []
+        for reference in df['REFERENCE']:
+            if reference not in reference_codes:
+                reference_codes[reference] = len(references)
+                references.append(reference)
+            type_codes.append(reference_codes[reference])
+        codes[spectrum_type] = type_codes
+
+    reference_dtype = '<u2' if len(references) <= 0xFFFF else '<u4'
+    payload = {'format': response_format, 'references': references}
+    if response_format == 'binary':
+        payload['dtypes'] = {'wavelength': '<f4', 'value': '<f4', 'reference': reference_dtype}
+
+    for spectrum_type, value_column in SPECTRUM_VALUE_COLUMNS.items():
+        if spectrum_type in frames:
+            df = frames[spectrum_type]
+            wavelength = df[wavelength_column].to_numpy(dtype=np.float64)
+            value = df[value_column].to_numpy(dtype=np.float64)
+        else:
+            wavelength = value = np.empty(0)
+            codes[spectrum_type] = []
+        series = {'wavelength_column': wavelength_column, 'value_column': value_column, 'count': len(wavelength)}
+        if response_format == 'binary':
+            series['wavelength'] = encode_array(wavelength, '<f4')
+            series['value'] = encode_array(value, '<f4')
+            series['reference'] = encode_array(codes[spectrum_type], reference_dtype)
+        else:
+            series['wavelength'] = wavelength.tolist()
+            series['value'] = value.tolist()
+            series['reference'] = codes[spectrum_type]
+        payload[spectrum_type] = series
+
+    return payload
+
+def iter_spectra_chunks(frames, wavelength_column, response_format, chunk_size):
+    # Chunks carry their spectrum type and reference, so unlike
+    # encode_spectra() no shared reference table has to be built up front
+    for spectrum_type, value_column in SPECTRUM_VALUE_COLUMNS.items():
+        if spectrum_type not in frames:
+            continue
+        for reference, df in frames[spectrum_type].groupby('REFERENCE', sort=False, observed=True):
+            for start in range(0, len(df), chunk_size):
+                part = df.iloc[start:start + chunk_size]
+                chunk = {'spectrum_type': spectrum_type, 'reference': reference, 'count': len(part)}
+                if response_format == 'records':
+                    chunk['records'] = part.to_dict('records')
+                    yield chunk
+                    continue
+
+                wavelength = part[wavelength_column].to_numpy(dtype=np.float64)
+                value = part[value_column].to_numpy(dtype=np.float64)
+                chunk['wavelength_column'] = wavelength_column
+                chunk['value_column'] = value_column
+                if response_format == 'binary':
+                    chunk['dtypes'] = {'wavelength': '<f4', 'value': '<f4'}
+                    chunk['wavelength'] = encode_array(wavelength, '<f4')
+                    chunk['value'] = encode_array(value, '<f4')
+                else:
+                    chunk['wavelength'] = wavelength.tolist()
+                    chunk['value'] = value.tolist()
+                yield chunk
@@ -0,0 +1,134 @@
+import os
+import re
+import hashlib
+import numpy as np
+import planet_index
+import tbl_cache
+
+# Level-of-detail support for dense spectra (e.g. the ~11k point direct imaging
+# spectrum of VHS 1256-1257 b). Each reference's series is reduced with min/max
+# decimation, which keeps the extremes of every bucket so absorption features
+# survive. Coarser levels are precomputed per planet and stored next to the
+# parse cache, so a query for a zoomed-in window starts from the coarsest level
+# that still has enough points in that window.
+LOD_DIR = os.path.join(tbl_cache.CACHE_DIR, "lod")
+LOD_LEVELS = (256, 1024, 4096)
+
+def minmax_indices(values, max_points):
+    # Indices of the min and max of each of max_points // 2 equal buckets
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+
+    buckets = max(1, max_points // 2)
+    bucket_size = -(-n // buckets)
+    buckets = -(-n // bucket_size)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n] = values
+    grid = padded.reshape(buckets, bucket_size)
+
+    offsets = np.arange(buckets) * bucket_size
+    lows = offsets + np.nanargmin(grid, axis=1)
+    highs = offsets + np.nanargmax(grid, axis=1)
+    return np.unique(np.concatenate([lows, highs]))
+
+def planet_version(pl_name):
+    # Changes whenever any of the planet's files changes
+    index = planet_index.load_index()
+    digest = hashlib.sha256()
+    for filename in index['planets'].get(pl_name, []):
+        digest.update(filename.encode())
+        digest.update(index['files'][filename]['sha256'].encode())
+    return digest.hexdigest()[:16]
+
+def lod_path(pl_name):
+    return os.path.join(LOD_DIR, re.sub(r'[^A-Za-z0-9]+', '_', pl_name) + '.npz')
+
+def build_levels(frames, wavelength_column, value_columns):
+    # {(spectrum type, reference): [(x, y) per level, coarsest first]}
+    levels = {}
+    for spectrum_type, df in frames.items():
+        value_column = value_columns[spectrum_type]
+        for reference, group in df.groupby('REFERENCE', sort=True, observed=True):
+            x = group[wavelength_column].to_numpy(dtype=np.float64)
+            y = group[value_column].to_numpy(dtype=np.float64)
+            series_levels = []
+            for level in LOD_LEVELS:
+                if level < len(x):
+                    keep = minmax_indices(y, level)
+                    series_levels.append((x[keep], y[keep]))
+            levels[(spectrum_type, reference)] = series_levels
+    return levels
+
+def save_levels(path, version, levels):
+    arrays = {'version': np.array(version)}
+    keys = list(levels)
+    arrays['types'] = np.array([spectrum_type for spectrum_type, reference in keys], dtype=str)
+    arrays['references'] = np.array([reference for spectrum_type, reference in keys], dtype=str)
+    for i, key in enumerate(keys):
+        for level, (x, y) in enumerate(levels[key]):
+            arrays[f'{i}_{level}_x'] = x
+            arrays[f'{i}_{level}_y'] = y
+
+    os.makedirs(LOD_DIR, exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+def read_levels(path, version):
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as arrays:
+        if str(arrays['version']) != version:
+            return None
+        levels = {}
+        for i, key in enumerate(zip(arrays['types'], arrays['references'])):
+            series_levels = []
+            while f'{i}_{len(series_levels)}_x' in arrays:
+                level = len(series_levels)
+                series_levels.append((arrays[f'{i}_{level}_x'], arrays[f'{i}_{level}_y']))
+            levels[(str(key[0]), str(key[1]))] = series_levels
+    return levels
+
+def load_levels(pl_name, frames, wavelength_column, value_columns):
+    version = planet_version(pl_name)
+    path = lod_path(pl_name)
+    levels = read_levels(path, version)
+    if levels is None:
+        levels = build_levels(frames, wavelength_column, value_columns)
+        save_levels(path, version, levels)
+    return levels
+
+def window(x, wavelength_range):
+    if wavelength_range is None:
+        return 0, len(x)
+    start = np.searchsorted(x, wavelength_range[0], side='left')
+    stop = np.searchsorted(x, wavelength_range[1], side='right')
+    return start, stop
+
+def downsample(df, wavelength_column, value_column, max_points, series_levels=None, wavelength_range=None):
+    # Reduce every reference in df to at most max_points points inside
+    # wavelength_range; series_levels maps reference to its precomputed levels
+    import pandas as pd
+
+    parts = []
+    for reference, group in df.groupby('REFERENCE', sort=False, observed=True):
+        x = group[wavelength_column].to_numpy(dtype=np.float64)
+        y = group[value_column].to_numpy(dtype=np.float64)
+
+        # Coarsest level that still has max_points inside the window, else full resolution
+        for level_x, level_y in (series_levels or {}).get(reference, []):
+            start, stop = window(level_x, wavelength_range)
+            if stop - start >= max_points:
+                x, y = level_x, level_y
+                break
+
+        start, stop = window(x, wavelength_range)
+        x, y = x[start:stop], y[start:stop]
+        keep = minmax_indices(y, max_points)
+        parts.append(pd.DataFrame({wavelength_column: x[keep], value_column: y[keep], 'REFERENCE': reference}))
+
+    if not parts:
+        return df.iloc[0:0]
+    return pd.concat(parts, ignore_index=True).sort_values(wavelength_column, kind='stable', ignore_index=True)
@@ -0,0 +1,123 @@
+import os
+import json
+import numpy as np
+import planet_index
+import tbl_cache
+import instrumentation
+
+log = instrumentation.get_logger('spectral_index')
+
+# Archive-wide wavelength index for range queries such as "every planet with
+# transmission data between 1.1 and 1.7 microns". For each spectrum type all
+# points are stored in one structured .npy array sorted by planet and then
+# wavelength, with per-planet offsets in meta.json. Arrays are memory-mapped
+# and each planet's slice is binary searched, so a query never touches the
+# DataFrames or the points outside the requested range. Each point also keeps
+# its bandwidth and symmetric uncertainty for spectra_aggregate.py.
+INDEX_DIR = os.path.join(tbl_cache.CACHE_DIR, "spectral_index")
+META_FILE = os.path.join(INDEX_DIR, "meta.json")
+
+INDEX_FORMAT = 2
+
+POINT_DTYPE = np.dtype([('wavelength', '<f8'), ('value', '<f8'), ('bandwidth', '<f8'), ('error', '<f8'), ('reference', '<u4')])
+
+def array_path(spectrum_type):
+    return os.path.join(INDEX_DIR, f"{spectrum_type}.npy")
+
+def symmetric_error(frame, error_columns):
+    # Mean magnitude of the upper and lower uncertainty, or whichever one is
+    # given; NaN when the point has neither
+    errors = np.stack([
+        np.abs(frame[col].to_numpy(dtype=np.float64)) if col in frame.columns else np.full(len(frame), np.nan)
+        for col in error_columns
+    ])
+    present = ~np.isnan(errors)
+    counts = present.sum(axis=0)
+    totals = np.where(present, errors, 0.0).sum(axis=0)
+    return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+
+def build_spectral_index(planet_data, value_columns, error_columns):
+    # planet_data is the full merge_planet_data() result, including the
+    # BANDWIDTH and error_columns columns
+    version = planet_index.archive_version(planet_index.load_index())
+    planets = sorted(planet_data)
+    references = []
+    reference_codes = {}
+    meta = {'version': version, 'format': INDEX_FORMAT, 'planets': planets, 'references': references, 'offsets': {}}
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    for spectrum_type, value_column in value_columns.items():
+        chunks = []
+        offsets = [0]
+        for pl_name in planets:
+            df = planet_data[pl_name].get('merged_data')
+            count = 0
+            if df is not None and value_column in df.columns and 'CENTRALWAVELNG' in df.columns:
+                frame = df.dropna(subset=['CENTRALWAVELNG', value_column, 'REFERENCE'])
+                frame = frame.sort_values('CENTRALWAVELNG', kind='stable')
+                points = np.empty(len(frame), dtype=POINT_DTYPE)
+                points['wavelength'] = frame['CENTRALWAVELNG'].to_numpy(dtype=np.float64)
+                points['value'] = frame[value_column].to_numpy(dtype=np.float64)
+                points['bandwidth'] = frame['BANDWIDTH'].to_numpy(dtype=np.float64) if 'BANDWIDTH' in frame.columns else np.nan
+                points['error'] = symmetric_error(frame, error_columns[spectrum_type])
+                for reference in frame['REFERENCE'].unique():
+                    if reference not in reference_codes:
+                        reference_codes[reference] = len(references)
+                        references.append(reference)
+                points['reference'] = frame['REFERENCE'].map(reference_codes).to_numpy()
+                chunks.append(points)
+                count = len(points)
+            offsets.append(offsets[-1] + count)
+
+        points = np.concatenate(chunks) if chunks else np.empty(0, dtype=POINT_DTYPE)
+        np.save(array_path(spectrum_type), points, allow_pickle=False)
+        meta['offsets'][spectrum_type] = offsets
+
+    tmp_file = META_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, META_FILE)
+    log.info("Built spectral index for %d planets", len(planets))
+
+def load_spectral_index():
+    # Returns None when the index is missing or older than the archive
+    if not os.path.exists(META_FILE):
+        return None
+
+    with open(META_FILE, 'r') as f:
+        meta = json.load(f)
+    if meta.get('format') != INDEX_FORMAT or meta['version'] != planet_index.archive_version(planet_index.load_index()):
+        return None
+
+    arrays = {}
+    for spectrum_type in meta['offsets']:
+        arrays[spectrum_type] = np.load(array_path(spectrum_type), mmap_mode='r', allow_pickle=False)
+    meta['arrays'] = arrays
+    meta['planet_codes'] = {pl_name: i for i, pl_name in enumerate(meta['planets'])}
+    return meta
+
+def query_range(spectral_index, wavelength_range, spectrum_types=None, planets=None):
+    # {planet: {spectrum type: structured points inside wavelength_range}}
+    # for every planet with at least one point there
+    wave_min, wave_max = wavelength_range
+    if planets is None:
+        planet_codes = range(len(spectral_index['planets']))
+    else:
+        planet_codes = [spectral_index['planet_codes'][name] for name in planets if name in spectral_index['planet_codes']]
+
+    results = {}
+    for spectrum_type in spectrum_types or spectral_index['arrays']:
+        points = spectral_index['arrays'][spectrum_type]
+        offsets = spectral_index['offsets'][spectrum_type]
+        wavelengths = points['wavelength']
+        for code in planet_codes:
+            start, stop = offsets[code], offsets[code + 1]
+            if start == stop:
+                continue
+            first = start + np.searchsorted(wavelengths[start:stop], wave_min, side='left')
+            last = start + np.searchsorted(wavelengths[start:stop], wave_max, side='right')
+            if first < last:
+                pl_name = spectral_index['planets'][code]
+                results.setdefault(pl_name, {})[spectrum_type] = np.array(points[first:last])
+
+    return results
@@ -0,0 +1,268 @@
+import os
+import json
+import numpy as np
+import instrumentation
+
+log = instrumentation.get_logger('tbl_cache')
+
+# On-disk cache of parsed .tbl files. Every parsed file is stored as a single
+# structured .npy array (one field per column, strings as fixed-width unicode)
+# and recorded in a manifest keyed by file name together with the size and
+# mtime it had when it was parsed. Cached arrays are memory-mapped on load.
+CACHE_DIR = "parsed_cache"
+MANIFEST_FILE = os.path.join(CACHE_DIR, "manifest.json")
+CACHE_VERSION = 3
+
+def empty_manifest():
+    return {'version': CACHE_VERSION, 'files': {}}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return empty_manifest()
+
+    try:
+        with open(MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not read cache manifest, rebuilding: %s", e)
+        return empty_manifest()
+
+    if manifest.get('version') != CACHE_VERSION:
+        log.info("Cache manifest version changed, rebuilding.")
+        return empty_manifest()
+
+    return manifest
+
+def save_manifest(manifest):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_file = MANIFEST_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def is_entry_fresh(entry, path):
+    if not entry:
+        return False
+    signature = file_signature(path)
+    if entry['size'] != signature['size'] or entry['mtime'] != signature['mtime']:
+        return False
+    # Files without usable data have no cache file, only the manifest entry
+    return entry['cache'] is None or os.path.exists(entry['cache'])
+
+def cache_path(filename):
+    return os.path.join(CACHE_DIR, os.path.splitext(filename)[0] + '.npy')
+
+def write_entry(path, pl_name, result):
+    filename = os.path.basename(path)
+    entry = file_signature(path)
+    entry.update({'pl_name': pl_name, 'cache': None, 'columns': [], 'metadata': {}})
+
+    if result:
+        df, metadata = result
+        fields = []
+        for col in df.columns:
+            if df[col].dtype == object:
+                # Missing strings are stored as '' and restored as NaN on load
+                fields.append(df[col].fillna('').to_numpy(dtype=str))
+            else:
+                fields.append(df[col].to_numpy())
+        records = np.rec.fromarrays(fields, names=list(df.columns))
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        entry['cache'] = cache_path(filename)
+        np.save(entry['cache'], records, allow_pickle=False)
+        entry['columns'] = list(df.columns)
+        entry['metadata'] = metadata
+
+    return entry
+
+def read_entry(entry, columns=None):
+    # columns limits the frame to those of the file's columns; only they are
+    # read from the memory-mapped array
+    import pandas as pd
+
+    if entry['cache'] is None:
+        return None
+
+    records = np.load(entry['cache'], mmap_mode='r', allow_pickle=False)
+    names = entry['columns'] if columns is None else [col for col in entry['columns'] if col in columns]
+    columns = {}
+    for col in names:
+        values = records[col]
+        if values.dtype.kind == 'U':
+            # Strings come back as fixed-width unicode; keep them as objects like load_data() does
+            strings = values.astype(object)
+            strings[values == ''] = np.nan
+            columns[col] = strings
+        else:
+            columns[col] = np.array(values)
+    return pd.DataFrame(columns, columns=names), entry['metadata']
+
+def remove_entry(manifest, filename):
+    entry = manifest['files'].pop(filename, None)
+    if entry and entry['cache'] and os.path.exists(entry['cache']):
+        os.remove(entry['cache'])
+
+# Merged store: the merged frame of every planet from the last full merge,
+# kept archive-wide as one .npy array per column (strings as int32 codes into
+# a categories array) with per-planet offsets. A warm merge slices it and
+# builds one frame per planet instead of loading one array per file. It is
+# used only while the planet index is at the archive version it was built
+# from and every requested file still has the signature it had then, and only for the columns it was built with that have one type across
+# the archive (float or string); other columns are read from the per-file cache.
+STORE_DIR = os.path.join(CACHE_DIR, "store")
+STORE_META = os.path.join(STORE_DIR, "meta.json")
+
+def store_array_path(col, suffix=''):
+    return os.path.join(STORE_DIR, f"{col}{suffix}.npy")
+
+def column_kind(series):
+    import pandas as pd
+
+    if series.dtype == np.float64:
+        return 'f'
+    if series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        return 'U'
+    return None
+
+def write_store(planet_data, file_planets, files, read_columns, archive_version):
+    # planet_data is a merge of files limited to read_columns (None for all);
+    # file_planets maps each file name with data to its planet
+    planets = sorted(pl_name for pl_name in planet_data if 'merged_data' in planet_data[pl_name])
+    frames = [planet_data[pl_name]['merged_data'] for pl_name in planets]
+
+    kinds = {}
+    for df in frames:
+        for col in df.columns:
+            kinds.setdefault(col, set()).add(column_kind(df[col]))
+    columns = {col: kind.pop() for col, kind in kinds.items() if len(kind) == 1 and None not in kind}
+
+    # The old meta goes first, so a partly written store is never used
+    os.makedirs(STORE_DIR, exist_ok=True)
+    if os.path.exists(STORE_META):
+        os.remove(STORE_META)
+    for filename in os.listdir(STORE_DIR):
+        os.remove(os.path.join(STORE_DIR, filename))
+
+    for col, kind in columns.items():
+        if kind == 'f':
+            values = [df[col].to_numpy(dtype=np.float64) if col in df.columns else np.full(len(df), np.nan) for df in frames]
+            np.save(store_array_path(col), np.concatenate(values) if values else np.empty(0), allow_pickle=False)
+            continue
+
+        # Missing strings are code -1
+        strings = np.concatenate([df[col].fillna('').to_numpy(dtype=str) if col in df.columns else np.full(len(df), '')
+                                  for df in frames])
+        categories, codes = np.unique(strings, return_inverse=True)
+        codes = codes.astype(np.int32)
+        if len(categories) and categories[0] == '':
+            categories = categories[1:]
+            codes -= 1
+        np.save(store_array_path(col), codes, allow_pickle=False)
+        np.save(store_array_path(col, '.categories'), categories, allow_pickle=False)
+
+    planet_files = {}
+    for filename, pl_name in file_planets.items():
+        planet_files.setdefault(pl_name, []).append(filename)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'archive_version': archive_version,
+        'signatures': {os.path.basename(file): list(file_signature(file).values()) for file in files},
+        'file_planets': file_planets,
+        'planet_files': planet_files,
+        'planets': planets,
+        'offsets': np.cumsum([0] + [len(df) for df in frames]).tolist(),
+        'read_columns': list(read_columns) if read_columns is not None else None,
+        'columns': columns,
+        'unstored_columns': sorted(col for col in kinds if col not in columns),
+        'planet_columns': {pl_name: list(df.columns) for pl_name, df in zip(planets, frames)},
+        'metadata': {pl_name: planet_data[pl_name]['metadata'] for pl_name in planets}
+    }
+    tmp_file = STORE_META + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, STORE_META)
+    log.info("Built merged store for %d planets", len(planets))
+
+def load_store():
+    if not os.path.exists(STORE_META):
+        return None
+    try:
+        with open(STORE_META, 'r') as f:
+            store = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Could not read merged store, ignoring it: %s", e)
+        return None
+    if store.get('version') != CACHE_VERSION:
+        return None
+    store['planet_codes'] = {pl_name: i for i, pl_name in enumerate(store['planets'])}
+    store['arrays'] = {}
+    return store
+
+def store_column(store, col):
+    # Memory-mapped on first use
+    if col not in store['arrays']:
+        values = np.load(store_array_path(col), mmap_mode='r', allow_pickle=False)
+        categories = None
+        if store['columns'][col] == 'U':
+            categories = np.load(store_array_path(col, '.categories'), allow_pickle=False).astype(object)
+            categories = np.append(categories, np.nan)
+        store['arrays'][col] = values, categories
+    return store['arrays'][col]
+
+def read_store_planet(store, pl_name, columns=None, categorical=()):
+    # String columns in categorical come back as pandas categoricals of the
+    # planet's own values, as astype('category') would make them
+    import pandas as pd
+
+    code = store['planet_codes'][pl_name]
+    start, stop = store['offsets'][code], store['offsets'][code + 1]
+    names = [col for col in store['planet_columns'][pl_name] if columns is None or col in columns]
+    data = {}
+    for col in names:
+        values, categories = store_column(store, col)
+        if categories is None:
+            data[col] = np.array(values[start:stop])
+        elif col in categorical:
+            codes = np.array(values[start:stop])
+            used = np.unique(codes[codes >= 0])
+            data[col] = pd.Categorical.from_codes(np.where(codes >= 0, np.searchsorted(used, codes), -1), categories[used])
+        else:
+            # Code -1 picks the NaN appended to the categories
+            data[col] = categories[values[start:stop]]
+    return pd.DataFrame(data, columns=names)
+
+def read_store(store, archive_version, files, columns=None, complete=False, categorical=()):
+    # {planet: {'merged_data', 'metadata'}} for the planets of files, or None
+    # when the store cannot answer exactly what merging the files would;
+    # complete requires files to be the whole archive the store was built from
+    if store.get('archive_version') != archive_version:
+        return None
+    signatures = store['signatures']
+    names = {os.path.basename(file) for file in files}
+    if complete and names != set(signatures):
+        return None
+    for file in files:
+        if signatures.get(os.path.basename(file)) != list(file_signature(file).values()):
+            return None
+    if columns is None:
+        if store['read_columns'] is not None or store['unstored_columns']:
+            return None
+    elif store['read_columns'] is not None and not set(columns) <= set(store['read_columns']):
+        return None
+    elif set(columns) & set(store['unstored_columns']):
+        return None
+
+    planets = dict.fromkeys(store['file_planets'][name] for name in sorted(names) if name in store['file_planets'])
+    if any(not set(store['planet_files'][pl_name]) <= names for pl_name in planets):
+        return None
+
+    return {
+        pl_name: {'merged_data': read_store_planet(store, pl_name, columns, categorical), 'metadata': store['metadata'][pl_name]}
+        for pl_name in planets
+    }
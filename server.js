@@ -1268,50 +1268,399 @@ function determinePlanetType(planet) {
     return 'Unknown';
 }
 
-app.get('/api/planet-spectra/:planetName', (req, res) => {
-    const { planetName } = req.params;
-    
-    const pythonScriptPath = path.join(__dirname, 'exoAtmosSpectra', 'planet_data_viewer.py');
-    console.log(`Executing Python script for planet: ${planetName}`);
-    console.log(`Python script path: ${pythonScriptPath}`);
+// Long-lived Python worker that keeps the merged spectra archive in memory.
+// Requests and responses are single JSON lines matched up by id.
+const spectraScriptPath = path.join(__dirname, 'exoAtmosSpectra', 'planet_data_viewer.py');
+const pendingSpectraRequests = new Map();
+let spectraWorker = null;
+let spectraWorkerBuffer = '';
+let nextSpectraRequestId = 1;
+
+function rejectPendingSpectraRequests(error) {
+    for (const { reject } of pendingSpectraRequests.values()) {
+        reject(error);
+    }
+    pendingSpectraRequests.clear();
+}
+
+function handleSpectraWorkerLine(line) {
+    if (!line) {
+        return;
+    }
+
+    let message;
+    try {
+        message = JSON.parse(line);
+    } catch (error) {
+        // Anything that is not a protocol line (e.g. downloader output) is just logged
+        console.log(`Python stdout: ${line}`);
+        return;
+    }
+
+    const pending = pendingSpectraRequests.get(message.id);
+    if (!pending) {
+        console.error(`Received response for unknown spectra request: ${message.id}`);
+        return;
+    }
+
+    // Batch requests stream one item per planet before their final result
+    if (message.item) {
+        if (pending.onItem) {
+            pending.onItem(message.item);
+        }
+        return;
+    }
+
+    pendingSpectraRequests.delete(message.id);
+    if (message.error) {
+        pending.reject(new Error(message.error));
+    } else {
+        pending.resolve(message.result);
+    }
+}
 
-    const pythonProcess = spawn('python3', [pythonScriptPath, planetName], {
+function startSpectraWorker() {
+    console.log(`Starting spectra worker: ${spectraScriptPath}`);
+
+    const worker = spawn('python3', [spectraScriptPath, '--serve'], {
         cwd: path.join(__dirname, 'exoAtmosSpectra'),
         stdio: 'pipe'
     });
 
-    let dataString = '';
-    let errorString = '';
+    spectraWorkerBuffer = '';
 
-    pythonProcess.stdout.on('data', (data) => {
-        dataString += data.toString();
+    worker.stdout.on('data', (data) => {
+        spectraWorkerBuffer += data.toString();
+        let newlineIndex;
+        while ((newlineIndex = spectraWorkerBuffer.indexOf('\n')) !== -1) {
+            const line = spectraWorkerBuffer.slice(0, newlineIndex).trim();
+            spectraWorkerBuffer = spectraWorkerBuffer.slice(newlineIndex + 1);
+            handleSpectraWorkerLine(line);
+        }
     });
 
-    pythonProcess.stderr.on('data', (data) => {
-        errorString += data.toString();
+    worker.stderr.on('data', (data) => {
         console.error(`Python stderr: ${data}`);
     });
 
-    pythonProcess.on('error', (error) => {
-        console.error(`Failed to start Python process: ${error}`);
-        res.status(500).json({ error: 'Failed to start Python process', details: error.message });
+    worker.stdin.on('error', (error) => {
+        console.error(`Failed to write to spectra worker: ${error}`);
+    });
+
+    worker.on('error', (error) => {
+        console.error(`Failed to start spectra worker: ${error}`);
+        if (spectraWorker === worker) {
+            spectraWorker = null;
+        }
+        rejectPendingSpectraRequests(error);
     });
 
-    pythonProcess.on('close', (code) => {
-        console.log(`Python script exited with code ${code}`);
-        if (code !== 0) {
-            console.error(`Python script error output: ${errorString}`);
-            return res.status(500).json({ error: 'Python script exited with non-zero code', details: errorString });
+    worker.on('close', (code) => {
+        console.log(`Spectra worker exited with code ${code}`);
+        if (spectraWorker === worker) {
+            spectraWorker = null;
         }
+        rejectPendingSpectraRequests(new Error(`Spectra worker exited with code ${code}`));
+    });
+
+    spectraWorker = worker;
+    return worker;
+}
+
+function requestSpectra(payload, onItem) {
+    return new Promise((resolve, reject) => {
+        const worker = spectraWorker || startSpectraWorker();
+        const id = nextSpectraRequestId++;
+        pendingSpectraRequests.set(id, { resolve, reject, onItem });
+        worker.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+}
+
+// Optional numeric query parameters, passed through to the spectra worker
+function parseOptionalNumber(value) {
+    if (value === undefined || value === '') {
+        return undefined;
+    }
+    const number = Number(value);
+    return Number.isFinite(number) ? number : undefined;
+}
+
+function isStreamRequested(query) {
+    return query.stream === '1' || query.stream === 'true';
+}
+
+// ?format=records (default) | columnar | binary, see spectra_encoding.py
+// ?max_points=N decimates each reference's series, ?wave_min=&wave_max= selects a window (microns)
+// ?stream=1 answers with newline-delimited JSON: one line per chunk of at most
+// ?chunk_size= points of one reference, then a {"done": true, "counts": ...} line
+app.get('/api/planet-spectra/:planetName', async (req, res) => {
+    const { planetName } = req.params;
+    const { format = 'records' } = req.query;
+    const maxPoints = parseOptionalNumber(req.query.max_points);
+    const chunkSize = parseOptionalNumber(req.query.chunk_size);
+    const stream = isStreamRequested(req.query);
+    console.log(`Requesting spectra for planet: ${planetName} (${format}${stream ? ', streamed' : ''})`);
+
+    const payload = {
+        planet: planetName,
+        format,
+        max_points: maxPoints === undefined ? undefined : Math.floor(maxPoints),
+        wave_min: parseOptionalNumber(req.query.wave_min),
+        wave_max: parseOptionalNumber(req.query.wave_max)
+    };
+
+    if (stream) {
+        res.setHeader('Content-Type', 'application/x-ndjson');
         try {
-            const spectraData = JSON.parse(dataString);
-            res.json(spectraData);
+            const result = await requestSpectra({
+                ...payload,
+                stream: true,
+                chunk_size: chunkSize === undefined ? undefined : Math.floor(chunkSize)
+            }, (chunk) => res.write(JSON.stringify(chunk) + '\n'));
+            res.end(JSON.stringify(result) + '\n');
         } catch (error) {
-            console.error('Error parsing spectra data:', error);
-            res.status(500).json({ error: 'Error processing spectra data', details: dataString });
+            console.error('Error streaming spectra data:', error);
+            res.end(JSON.stringify({ error: 'Error processing spectra data', details: error.message }) + '\n');
         }
+        return;
+    }
+
+    try {
+        const spectraData = await requestSpectra(payload);
+        res.json(spectraData);
+    } catch (error) {
+        console.error('Error processing spectra data:', error);
+        res.status(500).json({ error: 'Error processing spectra data', details: error.message });
+    }
+});
+
+function parseOptionalList(value) {
+    if (value === undefined || value === '') {
+        return undefined;
+    }
+    return String(value).split(',').map(item => item.trim()).filter(item => item);
+}
+
+// Spectra of many planets in one call: ?planets=a,b and/or ?prefix=WASP and/or
+// ?host=TRAPPIST-1, plus the same options as /api/planet-spectra. The response
+// is newline-delimited JSON, one {"planet", "result"} line per planet written as
+// soon as the worker has it, then a final {"done": true, "planets": [...]} line.
+// With ?stream=1 each planet arrives as {"planet", ...} chunks as above instead.
+app.get('/api/planet-spectra-batch', async (req, res) => {
+    const { format = 'records', prefix, host } = req.query;
+    const planets = parseOptionalList(req.query.planets);
+    if (!planets && !prefix && !host) {
+        return res.status(400).json({ error: 'planets, prefix or host is required' });
+    }
+    const maxPoints = parseOptionalNumber(req.query.max_points);
+    console.log(`Requesting batch spectra (${format})`);
+
+    res.setHeader('Content-Type', 'application/x-ndjson');
+    try {
+        const result = await requestSpectra({
+            action: 'batch',
+            planets,
+            prefix,
+            host,
+            format,
+            max_points: maxPoints === undefined ? undefined : Math.floor(maxPoints),
+            wave_min: parseOptionalNumber(req.query.wave_min),
+            wave_max: parseOptionalNumber(req.query.wave_max),
+            stream: isStreamRequested(req.query)
+        }, (item) => res.write(JSON.stringify(item) + '\n'));
+        res.end(JSON.stringify({ done: true, ...result }) + '\n');
+    } catch (error) {
+        console.error('Error processing batch spectra:', error);
+        res.end(JSON.stringify({ error: 'Error processing batch spectra', details: error.message }) + '\n');
+    }
+});
+
+// Summary row per planet with spectra (types, point counts, wavelength span,
+// instruments, references), optionally only planets with ?types=eclipse,...
+app.get('/api/planet-catalog', async (req, res) => {
+    try {
+        const catalog = await requestSpectra({ action: 'catalog', types: parseOptionalList(req.query.types) });
+        res.json(catalog);
+    } catch (error) {
+        console.error('Error loading planet catalog:', error);
+        res.status(500).json({ error: 'Error loading planet catalog', details: error.message });
+    }
+});
+
+// Prefix, substring and fuzzy search over catalog names and aliases: ?q=wasp 39&limit=10
+app.get('/api/planet-search', async (req, res) => {
+    const { q } = req.query;
+    if (!q) {
+        return res.status(400).json({ error: 'q is required' });
+    }
+    const limit = parseOptionalNumber(req.query.limit);
+
+    try {
+        const matches = await requestSpectra({
+            action: 'search',
+            query: q,
+            limit: limit === undefined ? undefined : Math.max(1, Math.floor(limit))
+        });
+        res.json(matches);
+    } catch (error) {
+        console.error('Error searching planets:', error);
+        res.status(500).json({ error: 'Error searching planets', details: error.message });
+    }
+});
+
+// Every planet with data between ?wave_min= and ?wave_max= (microns), optionally
+// narrowed by ?types=transmission,eclipse and ?planets=..., or only counts with ?summary=1
+app.get('/api/spectra-range', async (req, res) => {
+    const { format = 'records' } = req.query;
+    const waveMin = parseOptionalNumber(req.query.wave_min);
+    const waveMax = parseOptionalNumber(req.query.wave_max);
+    if (waveMin === undefined && waveMax === undefined) {
+        return res.status(400).json({ error: 'wave_min or wave_max is required' });
+    }
+    console.log(`Requesting spectra between ${waveMin} and ${waveMax} (${format})`);
+
+    try {
+        const rangeData = await requestSpectra({
+            action: 'range',
+            format,
+            wave_min: waveMin,
+            wave_max: waveMax,
+            types: parseOptionalList(req.query.types),
+            planets: parseOptionalList(req.query.planets),
+            summary: req.query.summary === '1' || req.query.summary === 'true'
+        });
+        res.json(rangeData);
+    } catch (error) {
+        console.error('Error processing spectra range:', error);
+        res.status(500).json({ error: 'Error processing spectra range', details: error.message });
+    }
+});
+
+// Per-bin statistics of one ?type= of spectrum across planets on a common
+// wavelength grid: point and planet counts, mean, inverse-variance weighted
+// mean and percentiles. Optional ?bins=, ?scale=log|linear, ?wave_min=,
+// ?wave_max=, ?percentiles=16,50,84 and a ?planets=/?prefix=/?host= selection.
+app.get('/api/spectra-aggregate', async (req, res) => {
+    const { type, scale, prefix, host } = req.query;
+    if (!type) {
+        return res.status(400).json({ error: 'type is required' });
+    }
+    const bins = parseOptionalNumber(req.query.bins);
+    const percentiles = parseOptionalList(req.query.percentiles);
+
+    try {
+        const aggregate = await requestSpectra({
+            action: 'aggregate',
+            type,
+            bins: bins === undefined ? undefined : Math.floor(bins),
+            scale,
+            wave_min: parseOptionalNumber(req.query.wave_min),
+            wave_max: parseOptionalNumber(req.query.wave_max),
+            percentiles: percentiles && percentiles.map(Number),
+            planets: parseOptionalList(req.query.planets),
+            prefix,
+            host
+        });
+        res.json(aggregate);
+    } catch (error) {
+        console.error('Error aggregating spectra:', error);
+        res.status(500).json({ error: 'Error aggregating spectra', details: error.message });
+    }
+});
+
+// Plots missing from the cache are rendered by planet_plots.py in its own
+// process, so the spectra worker keeps answering queries in the meantime.
+// Renders run one at a time, and a request for a plot that is already being
+// rendered waits for that render.
+const plotsScriptPath = path.join(__dirname, 'exoAtmosSpectra', 'planet_plots.py');
+const plotRenders = new Map();
+let plotRenderQueue = Promise.resolve();
+
+function runPlotRender(plot) {
+    return new Promise((resolve, reject) => {
+        const render = spawn('python3', [plotsScriptPath, '--render', plot.planet, '--type', plot.spectrum_type,
+                                         '--size', plot.size, '--format', plot.format], {
+            cwd: path.join(__dirname, 'exoAtmosSpectra'),
+            stdio: ['ignore', 'ignore', 'pipe']
+        });
+        let stderr = '';
+        render.stderr.on('data', (data) => {
+            stderr += data.toString();
+        });
+        render.on('error', reject);
+        render.on('close', (code) => {
+            if (code === 0) {
+                resolve();
+            } else {
+                reject(new Error(`Plot render exited with code ${code}: ${stderr}`));
+            }
+        });
     });
+}
+
+function renderPlot(plot) {
+    const key = JSON.stringify([plot.planet, plot.spectrum_type, plot.size, plot.format]);
+    if (!plotRenders.has(key)) {
+        const render = plotRenderQueue.then(() => runPlotRender(plot));
+        const done = () => plotRenders.delete(key);
+        plotRenderQueue = render.then(done, done);
+        plotRenders.set(key, render);
+    }
+    return plotRenders.get(key);
+}
+
+// Rendered plot of one spectrum type of a planet, e.g. a thumbnail for its card:
+// ?type= (default: the planet's first), ?size=thumbnail|full and ?format=png|svg.
+// The worker returns the cached file's path, rendering it first on a miss.
+// The URL does not change when the planet's data does, so the plot is sent
+// with its data version as the ETag and clients revalidate it.
+const PLOT_SIZES = ['thumbnail', 'full'];
+const PLOT_FORMATS = ['png', 'svg'];
+
+app.get('/api/planet-plot/:planetName', async (req, res) => {
+    const { planetName } = req.params;
+    const { type, size = 'thumbnail', format = 'png' } = req.query;
+    if (!PLOT_SIZES.includes(size)) {
+        return res.status(400).json({ error: `size must be one of ${PLOT_SIZES.join(', ')}` });
+    }
+    if (!PLOT_FORMATS.includes(format)) {
+        return res.status(400).json({ error: `format must be one of ${PLOT_FORMATS.join(', ')}` });
+    }
+
+    try {
+        let plot = await requestSpectra({ action: 'plot', planet: planetName, type, size, format });
+        if (plot.error) {
+            return res.status(404).json(plot);
+        }
+        if (!plot.path) {
+            await renderPlot(plot);
+            plot = await requestSpectra({ action: 'plot', planet: plot.planet, type: plot.spectrum_type, size, format });
+            if (plot.error || !plot.path) {
+                throw new Error(plot.error || `Plot of ${planetName} was not rendered`);
+            }
+        }
+        res.set('ETag', `"${plot.version}-${plot.spectrum_type}-${plot.size}.${plot.format}"`);
+        res.sendFile(plot.path, { lastModified: false });
+    } catch (error) {
+        console.error('Error rendering planet plot:', error);
+        res.status(500).json({ error: 'Error rendering planet plot', details: error.message });
+    }
+});
+
+// Stage timings (discover, parse, merge, query, encode, serialise, request)
+// and counters (requests, cache hits, files parsed, rows merged) of the spectra worker
+app.get('/api/spectra-metrics', async (req, res) => {
+    try {
+        res.json(await requestSpectra({ action: 'metrics' }));
+    } catch (error) {
+        console.error('Error reading spectra metrics:', error);
+        res.status(500).json({ error: 'Error reading spectra metrics', details: error.message });
+    }
 });
 
 const PORT = process.env.PORT || 3000;
-app.listen(PORT, () => console.log(`Server running on port ${PORT}`));
\ No newline at end of file
+app.listen(PORT, () => {
+    console.log(`Server running on port ${PORT}`);
+    // Warm the spectra worker so the first request does not pay for the archive load
+    startSpectraWorker();
+});
\ No newline at end of file
@@ -395,12 +395,15 @@ function removeSpectraDisplay() {
     }
 }
 
+// Points per reference requested from the spectra API; denser series are decimated server-side
+const SPECTRA_MAX_POINTS = 1000;
+
 async function displayPlanetSpectra(planetName) {
     try {
         showDataRefreshMessage(`Loading ${planetName} spectra...`);
         removeSpectraDisplay();
 
-        const response = await fetch(`/api/planet-spectra/${planetName}`);
+        const response = await fetch(`/api/planet-spectra/${planetName}?format=columnar&max_points=${SPECTRA_MAX_POINTS}`);
         const spectraData = await response.json();
         
         if (spectraData.error) {
@@ -432,7 +435,29 @@ async function displayPlanetSpectra(planetName) {
         
         spectraDiv.innerHTML = `<h2>${planetName} Spectra</h2>`;
         
-        const availableTypes = ['transmission', 'eclipse', 'direct_imaging'].filter(type => spectraData[type] && spectraData[type].length > 0);
+        const availableTypes = ['transmission', 'eclipse', 'direct_imaging'].filter(type => spectraData[type] && spectraData[type].count > 0);
+
+        // Expand the columnar arrays into chart points once per spectrum type
+        function toPoints(data, type) {
+            const series = data[type];
+            return series.wavelength.map((x, i) => ({
+                x,
+                y: series.value[i],
+                reference: data.references[series.reference[i]]
+            }));
+        }
+
+        const spectraPoints = {};
+        availableTypes.forEach(type => {
+            spectraPoints[type] = toPoints(spectraData, type);
+        });
+
+        // Points for the zoomed-in window, fetched at full detail for that range;
+        // null while the whole (decimated) spectrum is shown
+        let windowPoints = null;
+        // Bumped by every window request and by anything that replaces the view
+        // (reset zoom, a new chart), so only the latest request's answer is shown
+        let windowRequest = 0;
         
         if (availableTypes.length === 0) {
             spectraDiv.innerHTML += '<p>No spectral data available for this planet.</p>';
@@ -483,10 +508,41 @@ async function displayPlanetSpectra(planetName) {
 
         let currentChart = null;
 
+        function showPoints() {
+            const type = typeSelect.value;
+            const selectedReference = filterSelect.value;
+            const points = windowPoints || spectraPoints[type];
+            currentChart.data.datasets[0].data = selectedReference === 'all'
+                ? points
+                : points.filter(d => d.reference === selectedReference);
+            currentChart.update();
+        }
+
+        async function loadVisibleWindow({ chart }) {
+            const type = typeSelect.value;
+            const { min, max } = chart.scales.x;
+            const request = ++windowRequest;
+            try {
+                const windowResponse = await fetch(`/api/planet-spectra/${planetName}?format=columnar&max_points=${SPECTRA_MAX_POINTS}&wave_min=${min}&wave_max=${max}`);
+                const windowData = await windowResponse.json();
+                // Ignore answers for a chart, spectrum type or zoom that is no longer shown
+                if (windowData.error || windowData.message || request !== windowRequest || chart !== currentChart
+                    || type !== typeSelect.value) {
+                    return;
+                }
+                windowPoints = toPoints(windowData, type);
+                showPoints();
+            } catch (error) {
+                console.error('Error loading spectrum window:', error);
+            }
+        }
+
         function createChart(type) {
             if (currentChart) {
                 currentChart.destroy();
             }
+            windowPoints = null;
+            windowRequest++;
 
             spectrumContainer.innerHTML = '';
 
@@ -496,7 +552,7 @@ async function displayPlanetSpectra(planetName) {
             canvas.style.height = '100%';
             spectrumContainer.appendChild(canvas);
 
-            const references = [...new Set(spectraData[type].map(d => d.REFERENCE))];
+            const references = [...new Set(spectraPoints[type].map(d => d.reference))];
             filterSelect.innerHTML = `
                 <option value="all">All References</option>
                 ${references.map(ref => `<option value="${ref}">${ref}</option>`).join('')}
@@ -507,11 +563,7 @@ async function displayPlanetSpectra(planetName) {
                 data: {
                     datasets: [{
                         label: `${type.charAt(0).toUpperCase() + type.slice(1)} Spectrum`,
-                        data: spectraData[type].map(d => ({
-                            x: d.CENTRALWAVELNG, 
-                            y: d[type === 'transmission' ? 'PL_TRANDEP' : type === 'eclipse' ? 'ESPECLIPDEP' : 'FLAM'],
-                            reference: d.REFERENCE
-                        })),
+                        data: spectraPoints[type],
                         backgroundColor: 'rgba(255, 99, 132, 0.8)',
                         borderColor: 'rgba(255, 99, 132, 1)',
                         borderWidth: 1,
@@ -555,6 +607,7 @@ async function displayPlanetSpectra(planetName) {
                             pan: {
                                 enabled: true,
                                 mode: 'xy',
+                                onPanComplete: loadVisibleWindow,
                             },
                             zoom: {
                                 wheel: {
@@ -564,6 +617,7 @@ async function displayPlanetSpectra(planetName) {
                                     enabled: true
                                 },
                                 mode: 'xy',
+                                onZoomComplete: loadVisibleWindow,
                             },
                             limits: {
                                 x: {min: 'original', max: 'original', minRange: 0.1},
@@ -623,6 +677,9 @@ async function displayPlanetSpectra(planetName) {
         resetZoomButton.addEventListener('click', () => {
             if (currentChart) {
                 currentChart.resetZoom();
+                windowPoints = null;
+                windowRequest++;
+                showPoints();
             }
         });
 
@@ -635,20 +692,9 @@ async function displayPlanetSpectra(planetName) {
             }
         });
 
-        filterSelect.addEventListener('change', (event) => {
+        filterSelect.addEventListener('change', () => {
             if (currentChart) {
-                const selectedReference = event.target.value;
-                const currentType = typeSelect.value;
-                const filteredData = selectedReference === 'all' 
-                    ? spectraData[currentType] 
-                    : spectraData[currentType].filter(d => d.REFERENCE === selectedReference);
-                
-                currentChart.data.datasets[0].data = filteredData.map(d => ({
-                    x: d.CENTRALWAVELNG, 
-                    y: d[currentType === 'transmission' ? 'PL_TRANDEP' : currentType === 'eclipse' ? 'ESPECLIPDEP' : 'FLAM'],
-                    reference: d.REFERENCE
-                }));
-                currentChart.update();
+                showPoints();
             }
         });
 